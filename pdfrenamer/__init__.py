@@ -17,5 +17,6 @@ config.set('verbose',config.get('verbose')) #This is a quick and dirty way (to i
                                             #to the current value of config.get('verbose') (see config.py file for details)
 
 from .main import rename,build_filename
+from .results import RenameResult
 from .filename_creators import *
 
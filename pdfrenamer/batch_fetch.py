@@ -0,0 +1,177 @@
+'''
+This module allows to retrieve the data of many papers with a single request, when their identifiers are already known before their pdf files
+are processed (e.g. because they were derived from the file names, or found by the preflight check). Crossref (for DOIs) and export.arxiv.org
+(for arXiv IDs) both accept many identifiers in the same request, which is much faster, and much more polite towards the resolvers, than
+sending one request per file.
+The identifiers are collected by the function rename_files (see main.py) from the files which are about to be processed, until either
+config.get('batch_size') identifiers have been collected, or config.get('batch_window') seconds have passed since the first one was collected.
+They are then retrieved with one request per resolver (see the function flush), and the raw data are stored, so that the function
+lookup.lookup_identifier can use them instead of sending a request for each file. The raw data are in the same format returned by pdf2doi,
+so that they are parsed by pdf2bib exactly as the data retrieved for a single file. Since the data of Crossref are in the citeproc format,
+batching is disabled unless pdf2doi.config.get('method_dxdoiorg') = 'application/citeproc+json' (see the function get_fetcher).
+Identifiers which are not found in the batch response (e.g. DOIs which are not registered with Crossref, like those of DataCite) are simply
+looked up one by one, as usual. The endpoints can be changed via config.get('crossref_endpoint') and config.get('arxiv_endpoint').
+'''
+
+import json
+import time
+import logging
+import feedparser
+import requests
+import pdf2doi
+import pdfrenamer.config as config
+import pdfrenamer.bib_index as bib_index
+import pdfrenamer.metrics as metrics
+
+logger = logging.getLogger("pdf-renamer")
+
+request_timeout = 30 #Timeout (in seconds) of each batch request
+
+class BatchFetcher():
+    '''
+    Collects identifiers (see the method add) and retrieves their data in batches (see the method flush). The raw data retrieved for each
+    identifier can then be obtained with the method get.
+    '''
+
+    def __init__(self, batch_size=None, window=None):
+        self.batch_size = batch_size if batch_size is not None else config.get('batch_size')
+        self.window = window if window is not None else config.get('batch_window')
+        self.pending = []
+        self.first_added = None
+        self.data = dict()
+
+    def add(self, identifier, identifier_type):
+        key = make_key(identifier, identifier_type)
+        if key is None or key in self.data or key in self.pending:
+            return
+        if not self.pending:
+            self.first_added = time.monotonic()
+        self.pending.append(key)
+
+    def is_full(self):
+        '''
+        Returns True if the pending identifiers should be retrieved now, i.e. if there are at least self.batch_size of them, or if
+        the first of them was added more than self.window seconds ago.
+        '''
+        if not self.pending:
+            return False
+        return len(self.pending) >= self.batch_size or time.monotonic() - self.first_added >= self.window
+
+    def flush(self):
+        '''
+        Retrieves the data of all pending identifiers, with one request for each resolver (or more, if there are more than self.batch_size identifiers).
+        The data retrieved in previous calls are discarded, to keep the memory usage bounded.
+        '''
+        self.data = dict()
+        pending, self.pending = self.pending, []
+        dois = [key[1] for key in pending if key[0] == 'DOI']
+        arxiv_ids = [key[1] for key in pending if key[0] == 'arxiv ID']
+        for i in range(0, len(dois), self.batch_size):
+            self.data.update(fetch_crossref(dois[i:i + self.batch_size]))
+        for i in range(0, len(arxiv_ids), self.batch_size):
+            self.data.update(fetch_arxiv(arxiv_ids[i:i + self.batch_size]))
+        if pending:
+            logger.info(f"Retrieved the data of {len(self.data)} out of {len(pending)} identifier(s) with batch requests.")
+
+    def get(self, identifier, identifier_type):
+        '''
+        Returns the raw data retrieved for the identifier (in the same format returned by pdf2doi.validate), or None if they were not retrieved.
+        '''
+        return self.data.get(make_key(identifier, identifier_type))
+
+def make_key(identifier, identifier_type):
+    #Identifiers are stored in a normalized form, since the same identifier might be written in different ways (e.g. with or without the arXiv version)
+    if identifier_type == 'DOI':
+        doi = bib_index.normalize_doi(identifier)
+        return ('DOI', doi) if doi and ',' not in doi else None #Commas cannot be used in the filters of Crossref
+    if identifier_type == 'arxiv ID':
+        arxiv_id = bib_index.normalize_arxiv_id(identifier)
+        return ('arxiv ID', arxiv_id) if arxiv_id else None
+    return None
+
+def fetch_crossref(dois):
+    '''
+    Retrieves the data of all DOIs in the list dois with a single request to the works API of Crossref. Returns a dictionary whose keys are
+    tuples ('DOI', doi) and whose values are JSON strings in the citeproc format, i.e. the same format returned by dx.doi.org when
+    pdf2doi.config.get('method_dxdoiorg') = 'application/citeproc+json'.
+    '''
+    if not dois:
+        return dict()
+    params = {'filter': ','.join('doi:' + doi for doi in dois), 'rows': len(dois)}
+    try:
+        with metrics.lookup_seconds.time(backend='crossref_batch'):
+            r = requests.get(config.get('crossref_endpoint'), params=params, timeout=request_timeout)
+        r.raise_for_status()
+        items = r.json()['message']['items']
+    except Exception as e:
+        logger.error(f"Some error occured while retrieving the data of {len(dois)} DOI(s) from Crossref. They will be looked up one by one: {e}")
+        return dict()
+    data = dict()
+    for item in items:
+        doi = bib_index.normalize_doi(item.get('DOI'))
+        if doi in dois:
+            data[('DOI', doi)] = json.dumps(crossref_to_citeproc(item))
+    return data
+
+def crossref_to_citeproc(item):
+    '''
+    Converts the dictionary item, returned by the works API of Crossref, into the citeproc format returned by dx.doi.org. The two formats
+    are almost identical, except for some fields which are lists in the works API and strings in citeproc.
+    '''
+    item = dict(item)
+    for field in ['title', 'container-title', 'short-container-title', 'subtitle']:
+        if isinstance(item.get(field), list):
+            item[field] = item[field][0] if item[field] else ''
+    return item
+
+def fetch_arxiv(arxiv_ids):
+    '''
+    Retrieves the data of all arXiv IDs in the list arxiv_ids with a single request to the API of export.arxiv.org. Returns a dictionary whose keys
+    are tuples ('arxiv ID', arxiv_id) and whose values are the entries of the feed returned by export.arxiv.org, i.e. the same format returned by pdf2doi.
+    '''
+    if not arxiv_ids:
+        return dict()
+    params = {'id_list': ','.join(arxiv_ids), 'max_results': len(arxiv_ids)}
+    try:
+        with metrics.lookup_seconds.time(backend='arxiv_batch'):
+            r = requests.get(config.get('arxiv_endpoint'), params=params, timeout=request_timeout)
+        r.raise_for_status()
+        feed = feedparser.parse(r.content)
+    except Exception as e:
+        logger.error(f"Some error occured while retrieving the data of {len(arxiv_ids)} arXiv ID(s) from export.arxiv.org. They will be looked up one by one: {e}")
+        return dict()
+    data = dict()
+    for entry in feed.entries:
+        arxiv_id = bib_index.normalize_arxiv_id(entry.get('id'))
+        #export.arxiv.org returns an entry with the title "Error" for identifiers which do not exist
+        if arxiv_id in arxiv_ids and entry.get('title') != 'Error':
+            data[('arxiv ID', arxiv_id)] = entry
+    return data
+
+_fetcher = None
+
+def get_fetcher():
+    '''
+    Returns the BatchFetcher object used during the current run, or None if batching is disabled, i.e. if config.get('batch_size') < 2,
+    or if pdf2doi.config.get('method_dxdoiorg') is not 'application/citeproc+json' (the data retrieved from Crossref are in the citeproc
+    format, and they would not be parsed correctly by pdf2bib with any other method).
+    '''
+    global _fetcher
+    if config.get('batch_size') < 2:
+        return None
+    if pdf2doi.config.get('method_dxdoiorg') != 'application/citeproc+json':
+        logger.info("Batch requests are disabled, since dx.doi.org data are not requested in the citeproc format.")
+        return None
+    if _fetcher is None:
+        _fetcher = BatchFetcher()
+    return _fetcher
+
+def get(identifier, identifier_type):
+    '''
+    Returns the raw data retrieved in a batch for the identifier, or None if they are not available.
+    '''
+    if _fetcher is None:
+        return None
+    data = _fetcher.get(identifier, identifier_type)
+    metrics.lookups.inc(backend='batch', result='miss' if data is None else 'hit')
+    return data
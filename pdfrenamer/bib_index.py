@@ -0,0 +1,420 @@
+'''
+This module allows to use local bibliographies (e.g. the BibTeX or CSL-JSON files exported by Zotero or JabRef) as a source of metadata.
+Each bibliography is indexed by DOI, arXiv ID and normalized title, and the words of the titles are stored in an inverted index, which allows
+to find the entries whose title is similar to a given text (see the module title_matcher.py) without comparing the text with every entry. Whenever the identifier of a pdf file is known, its metadata are first
+looked for in the local bibliographies, and the remote resolvers are used only if the identifier is not found locally.
+Parsing a large bibliography is slow, so the index of each bibliography is stored in a SQLite database (in the folder bib_index inside the
+pdf-renamer folder). The database is rebuilt only when the bibliography file is modified, and it is queried directly, without loading
+the whole index in memory.
+The metadata of each entry are converted into the same format returned by pdf2bib, with the authors stored as a list of dictionaries
+[{'given': 'Name1', 'family': 'LastName1'}, ...], so that they can be used by build_filename and make_bibtex exactly as remote data.
+'''
+
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import unicodedata
+import logging
+import bibtexparser
+import pdfrenamer.config as config
+
+logger = logging.getLogger("pdf-renamer")
+
+path_current_directory = os.path.dirname(__file__)
+path_bib_indexes = os.path.join(path_current_directory, 'bib_index')
+
+#Must be increased whenever the format of the index changes, so that existing indexes are rebuilt
+index_version = 2
+
+schema = '''
+CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE entries (id INTEGER PRIMARY KEY, doi TEXT, arxiv TEXT, title TEXT, metadata TEXT NOT NULL);
+CREATE TABLE terms (id INTEGER PRIMARY KEY, term TEXT NOT NULL, df INTEGER NOT NULL);
+CREATE TABLE postings (term INTEGER NOT NULL, entry INTEGER NOT NULL, PRIMARY KEY (term, entry)) WITHOUT ROWID;
+'''
+
+#The indexes are created after all entries have been inserted, which is much faster than updating them at each insertion
+indexes = '''
+CREATE INDEX entries_doi ON entries (doi);
+CREATE INDEX entries_arxiv ON entries (arxiv);
+CREATE INDEX entries_title ON entries (title);
+CREATE UNIQUE INDEX terms_term ON terms (term);
+'''
+
+#Words which are too common to be useful when looking for similar titles
+stopwords = set(['a', 'an', 'and', 'are', 'as', 'at', 'by', 'for', 'from', 'in', 'into', 'is', 'of', 'on', 'or', 'the', 'to', 'via', 'with'])
+
+arxiv_id_pattern = re.compile(r'(?:arxiv[:/.\s]*)?(\d{4}\.\d{4,5}|[a-z\-]+(?:\.[A-Z]{2})?/\d{7})(?:v\d+)?', re.I)
+arxiv_doi_prefix = '10.48550/arxiv.'
+
+def normalize_doi(doi):
+    '''
+    Returns the DOI contained in the string doi in lower case and without any prefix (e.g. https://doi.org/ or doi:), or None if no DOI is found.
+    '''
+    if not doi:
+        return None
+    match = re.search(r'10\.\d{4,9}/\S+', str(doi))
+    return match.group(0).rstrip('.').lower() if match else None
+
+def normalize_arxiv_id(arxiv_id):
+    '''
+    Returns the arXiv ID contained in the string arxiv_id (e.g. 'arXiv:2305.12345v2' or 'https://arxiv.org/abs/2305.12345') without version, or None if no ID is found.
+    '''
+    if not arxiv_id:
+        return None
+    match = arxiv_id_pattern.search(str(arxiv_id))
+    return match.group(1).lower() if match else None
+
+def normalize_title(title):
+    '''
+    Returns a normalized version of the string title (without LaTeX commands, accents and punctuation, in lower case and with single spaces), which
+    is used to compare titles coming from different sources.
+    '''
+    if not title:
+        return ''
+    title = re.sub(r'\\[a-zA-Z]+\s*', ' ', clean_value(title))
+    title = unicodedata.normalize('NFKD', title).encode('ascii', 'ignore').decode('ascii')
+    return ' '.join(re.findall(r'[a-z0-9]+', title.lower()))
+
+_latex_accent = re.compile(r"\{?\\([`'^\"~=.uvHckr])\s*\{?([a-zA-Z])\}?\}?")
+
+#Unicode combining characters corresponding to the LaTeX accent commands
+_combining_accents = {'`': '\u0300', "'": '\u0301', '^': '\u0302', '~': '\u0303', '=': '\u0304', 'u': '\u0306', '.': '\u0307',
+                      '"': '\u0308', 'r': '\u030a', 'H': '\u030b', 'v': '\u030c', 'c': '\u0327', 'k': '\u0328'}
+
+def title_terms(normalized_title):
+    '''
+    Returns the set of words of the (already normalized) title normalized_title which are used in the inverted index.
+    '''
+    return set(word for word in normalized_title.split() if len(word) > 1 and word not in stopwords)
+
+def clean_value(value):
+    #Converts LaTeX accents into unicode characters (e.g. {\"u} becomes \u00fc), and removes braces and repeated white spaces from the string value
+    value = _latex_accent.sub(lambda m: unicodedata.normalize('NFC', m.group(2) + _combining_accents[m.group(1)]), str(value))
+    value = value.replace('{', '').replace('}', '').replace('\\&', '&')
+    return ' '.join(value.split())
+
+def split_top_level(text, separator):
+    #Splits the string text at each occurrence of separator which is not enclosed in braces
+    parts, depth, start, i = [], 0, 0, 0
+    lower = text.lower()
+    while i < len(text):
+        if text[i] == '{':
+            depth = depth + 1
+        elif text[i] == '}':
+            depth = max(depth - 1, 0)
+        elif depth == 0 and lower.startswith(separator, i):
+            parts.append(text[start:i])
+            i = i + len(separator)
+            start = i
+            continue
+        i = i + 1
+    parts.append(text[start:])
+    return parts
+
+def parse_bibtex_names(names):
+    '''
+    Converts the string names, containing a list of names in the BibTeX format (e.g. "Doe, John and Jane Smith and {Barnes and Noble}"),
+    into a list of dictionaries [{'given': 'John', 'family': 'Doe'}, {'given': 'Jane', 'family': 'Smith'}, {'family': 'Barnes and Noble'}].
+    Names in braces are not split, since they are typically names of organizations.
+    '''
+    authors = []
+    for name in split_top_level(' '.join(names.split()), ' and '):
+        name = name.strip()
+        if not name:
+            continue
+        if name.startswith('{') and name.endswith('}') and len(split_top_level(name[1:-1], ',')) == 1 and '{' not in name[1:-1]:
+            authors.append({'family': clean_value(name)})
+            continue
+        parts = [p.strip() for p in split_top_level(name, ',')]
+        if len(parts) >= 2:
+            #"Last, First" or "Last, Jr, First"
+            author = {'family': clean_value(parts[0]), 'given': clean_value(parts[-1])}
+        else:
+            words = split_top_level(name, ' ')
+            #Lowercase words before the last name (e.g. "van", "de") are part of the last name
+            i = len(words) - 1
+            while i > 1 and words[i-1][:1].islower():
+                i = i - 1
+            author = {'family': clean_value(' '.join(words[i:])), 'given': clean_value(' '.join(words[:i]))}
+        if not author.get('given'):
+            author.pop('given', None)
+        authors.append(author)
+    return authors
+
+def parse_bibtex(text):
+    '''
+    Parses the string text, containing a BibTeX bibliography, and returns a list of dictionaries (one per entry) whose keys are the field names in lower case.
+    Both version 1 and version 2 of bibtexparser are supported.
+    '''
+    if hasattr(bibtexparser, 'parse_string'):
+        library = bibtexparser.parse_string(text)
+        entries = []
+        for entry in library.entries:
+            fields = {field.key.lower(): field.value for field in entry.fields}
+            fields['ENTRYTYPE'] = entry.entry_type.lower()
+            fields['ID'] = entry.key
+            entries.append(fields)
+        return entries
+    parser = bibtexparser.bparser.BibTexParser(common_strings=True)
+    parser.ignore_nonstandard_types = False
+    return bibtexparser.loads(text, parser).entries
+
+def metadata_from_bibtex_entry(entry):
+    '''
+    Converts the dictionary entry (a BibTeX entry, as returned by parse_bibtex) into a tuple (doi, arxiv_id, metadata), where metadata is a
+    dictionary in the same format of the one returned by pdf2bib.
+    '''
+    eprint = entry.get('eprint') if (entry.get('archiveprefix', entry.get('eprinttype', 'arxiv')).lower() == 'arxiv') else None
+    arxiv_id = normalize_arxiv_id(eprint or entry.get('arxivid') or entry.get('arxiv'))
+    doi = normalize_doi(entry.get('doi'))
+    if not arxiv_id and doi and doi.startswith(arxiv_doi_prefix):
+        arxiv_id = normalize_arxiv_id(doi[len(arxiv_doi_prefix):])
+    if not arxiv_id and 'arxiv.org' in entry.get('url', ''):
+        arxiv_id = normalize_arxiv_id(entry['url'])
+    metadata = {'title': clean_value(entry.get('title', '')),
+                'author': parse_bibtex_names(entry.get('author', entry.get('editor', ''))),
+                'journal': clean_value(entry.get('journal', entry.get('journaltitle', entry.get('booktitle', '')))),
+                'volume': clean_value(entry.get('volume', '')),
+                'issue': clean_value(entry.get('number', '')),
+                'page': clean_value(entry.get('pages', '')).replace('--', '-'),
+                'publisher': clean_value(entry.get('publisher', '')),
+                'url': entry.get('url', ''),
+                'doi': doi or '',
+                'year': clean_value(entry.get('year', '')),
+                'month': clean_value(entry.get('month', ''))}
+    if not metadata['year'] and entry.get('date'):
+        #biblatex stores the date as YYYY-MM-DD
+        date = entry['date'].split('-')
+        metadata['year'] = date[0]
+        metadata['month'] = date[1] if len(date) > 1 else ''
+    if not metadata['journal'] and arxiv_id:
+        metadata['journal'] = 'arXiv'
+    return doi, arxiv_id, metadata
+
+def metadata_from_csl_item(item):
+    '''
+    Converts the dictionary item (an item of a CSL-JSON bibliography) into a tuple (doi, arxiv_id, metadata), where metadata is a
+    dictionary in the same format of the one returned by pdf2bib.
+    '''
+    doi = normalize_doi(item.get('DOI'))
+    arxiv_id = None
+    for field in ['arxiv', 'number', 'URL']:
+        value = item.get(field)
+        if value and (field == 'arxiv' or 'arxiv' in str(value).lower()):
+            arxiv_id = normalize_arxiv_id(value)
+            if arxiv_id:
+                break
+    if not arxiv_id and doi and doi.startswith(arxiv_doi_prefix):
+        arxiv_id = normalize_arxiv_id(doi[len(arxiv_doi_prefix):])
+    authors = []
+    for author in item.get('author', []):
+        if 'family' in author:
+            authors.append({key: author[key] for key in ['given', 'family'] if author.get(key)})
+        elif 'literal' in author:
+            authors.append({'family': author['literal']})
+    try:
+        date_parts = item['issued']['date-parts'][0]
+    except (KeyError, IndexError, TypeError):
+        date_parts = []
+    container_title = item.get('container-title', '')
+    if isinstance(container_title, list):
+        container_title = container_title[0] if container_title else ''
+    metadata = {'title': clean_value(item.get('title', '')),
+                'author': authors,
+                'journal': container_title or ('arXiv' if arxiv_id else ''),
+                'volume': str(item.get('volume', '')),
+                'issue': str(item.get('issue', '')),
+                'page': str(item.get('page', '')),
+                'publisher': item.get('publisher', ''),
+                'url': item.get('URL', ''),
+                'doi': doi or '',
+                'year': str(date_parts[0]) if len(date_parts) > 0 else '',
+                'month': str(date_parts[1]) if len(date_parts) > 1 else ''}
+    return doi, arxiv_id, metadata
+
+def read_bibliography(path):
+    '''
+    Reads the bibliography stored in the file path (a BibTeX file, or a CSL-JSON file if the extension is .json), and returns a list of tuples
+    (doi, arxiv_id, metadata), one for each entry.
+    '''
+    with open(path, 'r', encoding='utf-8') as f:
+        text = f.read()
+    if path.lower().endswith('.json'):
+        items = json.loads(text)
+        if isinstance(items, dict):
+            items = items.get('items', [items])
+        return [metadata_from_csl_item(item) for item in items]
+    return [metadata_from_bibtex_entry(entry) for entry in parse_bibtex(text)]
+
+class BibIndex():
+    '''
+    Index of the local bibliography stored in the file source. The index is stored in a SQLite database, which is (re)built by the method open
+    whenever it is missing or older than the bibliography.
+    '''
+
+    def __init__(self, source):
+        self.source = os.path.abspath(source)
+        name = hashlib.sha1(self.source.encode('utf-8')).hexdigest()[:16]
+        self.path = os.path.join(path_bib_indexes, name + '.sqlite')
+        self.connection = None
+
+    def signature(self):
+        #String which changes whenever the bibliography file is modified
+        stat = os.stat(self.source)
+        return f"{index_version}:{stat.st_size}:{stat.st_mtime_ns}"
+
+    def open(self):
+        '''
+        Opens the index, building it first if needed. Returns the number of entries in the index.
+        '''
+        signature = self.signature()
+        if os.path.exists(self.path):
+            connection = sqlite3.connect(self.path)
+            try:
+                row = connection.execute("SELECT value FROM meta WHERE key = 'signature'").fetchone()
+            except sqlite3.Error:
+                row = None
+            if row and row[0] == signature:
+                self.connection = connection
+                return self.connection.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+            connection.close()
+        logger.info(f"Indexing the bibliography {self.source}...")
+        entries = read_bibliography(self.source)
+        self.build(entries, signature)
+        self.connection = sqlite3.connect(self.path)
+        logger.info(f"Indexed {len(entries)} entries of the bibliography {self.source}.")
+        return len(entries)
+
+    def build(self, entries, signature):
+        #Writes the index into a temporary file, which then replaces the old index (if any), so that an interrupted build never leaves a corrupted index
+        os.makedirs(path_bib_indexes, exist_ok=True)
+        path_tmp = self.path + '.tmp'
+        if os.path.exists(path_tmp):
+            os.remove(path_tmp)
+        connection = sqlite3.connect(path_tmp)
+        #The temporary file is discarded if the build is interrupted, so there is no need to journal or sync the writes
+        connection.execute("PRAGMA journal_mode = OFF")
+        connection.execute("PRAGMA synchronous = OFF")
+        connection.executescript(schema)
+        rows, postings, term_ids, df = [], [], dict(), []
+        for i, (doi, arxiv_id, metadata) in enumerate(entries):
+            title = normalize_title(metadata['title'])
+            #Empty fields are not stored, to keep the index small
+            metadata = {key: value for key, value in metadata.items() if value}
+            rows.append((i + 1, doi, arxiv_id, title, json.dumps(metadata, separators=(',', ':'), ensure_ascii=False)))
+            for term in title_terms(title):
+                if term not in term_ids:
+                    term_ids[term] = len(df) + 1
+                    df.append(0)
+                df[term_ids[term] - 1] = df[term_ids[term] - 1] + 1
+                postings.append((term_ids[term], i + 1))
+        connection.executemany("INSERT INTO entries (id, doi, arxiv, title, metadata) VALUES (?, ?, ?, ?, ?)", rows)
+        connection.executemany("INSERT INTO terms (id, term, df) VALUES (?, ?, ?)", ((i, term, df[i - 1]) for term, i in term_ids.items()))
+        postings.sort()
+        connection.executemany("INSERT INTO postings (term, entry) VALUES (?, ?)", postings)
+        connection.executescript(indexes)
+        connection.executemany("INSERT INTO meta (key, value) VALUES (?, ?)", [('signature', signature), ('source', self.source)])
+        connection.commit()
+        connection.close()
+        os.replace(path_tmp, self.path)
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def find(self, column, value):
+        #Returns the metadata of the first entry whose column column is equal to value, or None
+        row = self.connection.execute(f"SELECT metadata FROM entries WHERE {column} = ? LIMIT 1", (value,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def lookup_identifier(self, identifier, identifier_type):
+        '''
+        Returns the metadata of the entry with the identifier identifier (whose type is either 'DOI', 'arxiv ID' or 'arxiv DOI', i.e. the same
+        values used by pdf2doi), or None if the identifier is not in the bibliography.
+        '''
+        doi = normalize_doi(identifier) if identifier_type in ('DOI', 'arxiv DOI') else None
+        arxiv_id = normalize_arxiv_id(identifier) if identifier_type == 'arxiv ID' else None
+        if doi and doi.startswith(arxiv_doi_prefix):
+            arxiv_id = normalize_arxiv_id(doi[len(arxiv_doi_prefix):])
+        metadata = None
+        if doi:
+            metadata = self.find('doi', doi)
+        if metadata is None and arxiv_id:
+            metadata = self.find('arxiv', arxiv_id)
+        return metadata
+
+    def lookup_title(self, title):
+        '''
+        Returns the metadata of the entry whose normalized title is equal to the normalized version of title, or None.
+        '''
+        title = normalize_title(title)
+        return self.find('title', title) if title else None
+
+    def search_title(self, text, max_terms=8, limit=20):
+        '''
+        Returns the entries whose titles share the largest number of words with the string text, as a list of dictionaries with the keys 'title' (normalized),
+        'doi', 'arxiv', 'metadata' and 'hits' (the number of shared words). Only the max_terms rarest words of text are used, so that the number of
+        entries examined depends on how common these words are, and not on the size of the bibliography. At most limit entries are returned.
+        '''
+        terms = list(title_terms(normalize_title(text)))
+        if not terms:
+            return []
+        placeholders = ','.join('?' * len(terms))
+        rows = self.connection.execute(f"SELECT id FROM terms WHERE term IN ({placeholders}) ORDER BY df LIMIT ?", terms + [max_terms]).fetchall()
+        term_ids = [row[0] for row in rows]
+        if not term_ids:
+            return []
+        placeholders = ','.join('?' * len(term_ids))
+        min_hits = (len(term_ids) + 1) // 2
+        rows = self.connection.execute(f"SELECT e.title, e.doi, e.arxiv, e.metadata, p.hits FROM " +
+                                       f"(SELECT entry, COUNT(*) AS hits FROM postings WHERE term IN ({placeholders}) GROUP BY entry HAVING hits >= ? ORDER BY hits DESC LIMIT ?) p " +
+                                       "JOIN entries e ON e.id = p.entry", term_ids + [min_hits, limit]).fetchall()
+        return [{'title': title, 'doi': doi, 'arxiv': arxiv, 'metadata': json.loads(metadata), 'hits': hits} for title, doi, arxiv, metadata, hits in rows]
+
+_indexes = []
+
+def load_sources(sources=None):
+    '''
+    Opens the indexes of all the bibliographies listed in sources (a list of paths). If sources is not specified, the paths contained
+    in config.get('bib_sources') (separated by os.pathsep) are used. Returns the list of opened indexes.
+    '''
+    global _indexes
+    if sources is None:
+        sources = [s for s in config.get('bib_sources').split(os.pathsep) if s]
+    close_all()
+    for source in sources:
+        if not os.path.isfile(source):
+            logger.error(f"{source} is not a valid path to a bibliography file, and it will be ignored.")
+            continue
+        index = BibIndex(source)
+        try:
+            index.open()
+        except Exception as e:
+            logger.error(f"Some error occured while indexing the bibliography {source}, which will be ignored: \n " + str(e))
+            continue
+        _indexes.append(index)
+    return _indexes
+
+def close_all():
+    global _indexes
+    for index in _indexes:
+        index.close()
+    _indexes = []
+
+def is_active():
+    return len(_indexes) > 0
+
+def lookup_identifier(identifier, identifier_type):
+    '''
+    Looks for the identifier identifier in all local bibliographies (in the order in which they were specified). Returns a tuple
+    (metadata, source), where source is the path of the bibliography, or (None, None) if the identifier was not found.
+    '''
+    for index in _indexes:
+        metadata = index.lookup_identifier(identifier, identifier_type)
+        if metadata:
+            return metadata, index.source
+    return None, None
@@ -13,7 +13,30 @@ class config():
             'check_subfolders' : False,
             'force_rename' : True,
             'case' : '',
-            'add_metadata' : True
+            'add_metadata' : True,
+            'duplicates' : 'report',
+            'filename_patterns' : True,
+            'filename_patterns_min_confidence' : 'medium',
+            'preflight' : True,
+            'preflight_window' : 1024,
+            'file_timeout' : 0,
+            'file_max_mem' : 0,
+            'worker_max_files' : 100,
+            'schedule' : 'cost',
+            'queue_lease_time' : 300,
+            'bib_sources' : '',
+            'title_match_threshold' : 90,
+            'title_match_borderline' : 70,
+            'batch_size' : 20,
+            'batch_window' : 2,
+            'crossref_endpoint' : 'https://api.crossref.org/works',
+            'arxiv_endpoint' : 'http://export.arxiv.org/api/query',
+            'metrics_port' : 0,
+            'metrics_file' : '',
+            'metrics_interval' : 15,
+            'retry_max_attempts' : 5,
+            'retry_base_delay' : 60,
+            'retry_max_delay' : 21600
             }
     __setters = __params.keys()
 
@@ -0,0 +1,123 @@
+'''
+This module contains the functions used to detect byte-identical copies of the same pdf file within a batch of files.
+To keep the amount of data read from disk as small as possible, files are compared in three successive steps: first they are
+grouped by size, then (only for groups containing more than one file) by a hash of a small portion of the file, and finally
+(only for groups which still contain more than one file) by a hash of the full file. Paths which point to the same file (e.g. hard links)
+are grouped together without comparing their content.
+'''
+
+import os
+import hashlib
+import logging
+
+logger = logging.getLogger("pdf-renamer")
+
+partial_hash_size = 64 * 1024   #Number of bytes read from the beginning and from the end of each file to calculate the partial hash
+chunk_size = 1024 * 1024        #Size of the chunks used to read a file when calculating the full hash
+
+def partial_hash(filename):
+    '''
+    Calculates a hash of the first and last partial_hash_size bytes of the file filename.
+    '''
+    h = hashlib.blake2b(digest_size=16)
+    with open(filename, 'rb') as f:
+        h.update(f.read(partial_hash_size))
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        if size > 2 * partial_hash_size:
+            f.seek(size - partial_hash_size)
+            h.update(f.read(partial_hash_size))
+    return h.hexdigest()
+
+def full_hash(filename):
+    '''
+    Calculates a hash of the whole content of the file filename.
+    '''
+    h = hashlib.blake2b(digest_size=32)
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+def group_by(files, key):
+    '''
+    Groups the files contained in the input list files according to the value returned by the function key for each of them.
+    Only groups containing more than one file are returned. Files for which key raises an OSError (e.g. because they cannot be read)
+    are ignored. The order of files within each group is the same as in the input list.
+    '''
+    groups = dict()
+    for f in files:
+        try:
+            value = key(f)
+        except OSError as e:
+            logger.error(f"The file {f} could not be read while looking for duplicates: {e}")
+            continue
+        groups.setdefault(value, []).append(f)
+    return [group for group in groups.values() if len(group) > 1]
+
+def find_hard_links(files):
+    '''
+    Finds the paths, among those contained in the input list files, which point to the same file (i.e. to the same inode) as a path
+    appearing earlier in the list, e.g. because they are hard links to each other.
+
+    Returns
+    -------
+    dictionary
+        Each key is a path which points to the same file as a previous path in the list files, and the corresponding value is the first
+        of such paths. Paths which do not share their inode with any other path are not included.
+    '''
+    links = dict()
+    first_path = dict()
+    for f in files:
+        try:
+            stat = os.stat(f)
+        except OSError:
+            continue
+        if not stat.st_ino: #Some file systems do not provide inode numbers
+            continue
+        inode = (stat.st_dev, stat.st_ino)
+        if inode in first_path:
+            links[f] = first_path[inode]
+        else:
+            first_path[inode] = f
+    return links
+
+def find_duplicates(files):
+    '''
+    Finds all groups of byte-identical files among the files contained in the input list files. Paths which point to the same file
+    (e.g. hard links, see the function find_hard_links) are included in the same group, even though their content is compared only once.
+
+    Parameters
+    ----------
+    files : list of strings
+        Paths of the files to compare
+
+    Returns
+    -------
+    list of lists of strings
+        Each element of the list is a group of (at least two) byte-identical files. Within each group, files appear in the same
+        order as in the input list, so that the first element of each group can be used as the representative of the group.
+    '''
+    #The content of each file is read only once, even if more than one path points to it
+    links = find_hard_links(files)
+    unique_files = [f for f in files if f not in links]
+
+    duplicates = []
+    for group_size in group_by(unique_files, os.path.getsize):
+        for group_partial in group_by(group_size, partial_hash):
+            duplicates.extend(group_by(group_partial, full_hash))
+
+    #Each hard link is added to the group of the file it points to (or, if that file has no copies, to a new group)
+    group_of = {f: group for group in duplicates for f in group}
+    for link, target in links.items():
+        if target not in group_of:
+            group_of[target] = [target]
+            duplicates.append(group_of[target])
+        group_of[target].append(link)
+
+    #Groups, and files within each group, are sorted according to their position in the input list
+    position = {f: i for i, f in enumerate(files)}
+    for group in duplicates:
+        group.sort(key=lambda f: position[f])
+    duplicates.sort(key=lambda group: position[group[0]])
+    return duplicates
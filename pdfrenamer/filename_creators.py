@@ -7,6 +7,7 @@ import re
 import pkgutil
 import pdf2bib
 import pdfrenamer.config as config
+import pdfrenamer.metrics as metrics
 import logging
 import unidecode
 logger = logging.getLogger("pdf-renamer")
@@ -107,6 +108,11 @@ def sanitize(string):
 
     return string
 
+#Abbreviations already looked up during this run (or None, for journals without abbreviation), so that the files of abbreviations are read only once
+#for each journal. This matters when many files are renamed without any lookup (e.g. with --reformat)
+abbreviations_cache = dict()
+
+@metrics.timed(metrics.journal_abbreviation_seconds)
 def find_abbreviation_journal(journal_name):
     """
     Find a journal abbreviation for a given journal name.
@@ -123,16 +129,22 @@ def find_abbreviation_journal(journal_name):
 
     """
     to_search = sanitize( (journal_name.strip() + " = ").lower() )
-
-    data = pkgutil.get_data(__name__, "UserDefinedAbbreviations.txt").decode('utf8')
-    for line in data.splitlines():
-        if (line.lower()).startswith(to_search):
-            return line[len(to_search):].rstrip()
-
-    data = pkgutil.get_data(__name__, "StandardAbbreviations.txt").decode('utf8')
-    for line in data.splitlines():
-        if (line.lower()).startswith(to_search):
-            return line[len(to_search):].rstrip()
+    if to_search in abbreviations_cache:
+        abbreviation = abbreviations_cache[to_search]
+        metrics.journal_abbreviation_cache.inc(result='hit')
+        metrics.journal_abbreviations.inc(result='found' if abbreviation else 'not_found')
+        return abbreviation
+
+    metrics.journal_abbreviation_cache.inc(result='miss')
+    abbreviations_cache[to_search] = None
+    for file in ["UserDefinedAbbreviations.txt", "StandardAbbreviations.txt"]:
+        data = pkgutil.get_data(__name__, file).decode('utf8')
+        for line in data.splitlines():
+            if (line.lower()).startswith(to_search):
+                metrics.journal_abbreviations.inc(result='found')
+                abbreviations_cache[to_search] = line[len(to_search):].rstrip()
+                return abbreviations_cache[to_search]
+    metrics.journal_abbreviations.inc(result='not_found')
     return None
 
 def find_tags_in_format(format):
@@ -160,6 +172,7 @@ def check_format_is_valid(format):
     return tags
 
 
+@metrics.timed(metrics.build_filename_seconds)
 def build_filename(infos,   format = None, tags=None):
     '''
     It generates a filename based on the metadata contained in the input dictionary 'infos', using the format specified 
@@ -0,0 +1,152 @@
+'''
+This module contains the functions used to derive the identifier of a paper directly from the name of its pdf file, without reading the file.
+This works for files downloaded from arXiv (e.g. 2305.12345v2.pdf) and from many publishers (e.g. PhysRevLett.130.123456.pdf or
+s41586-023-01234-5.pdf), whose names encode the identifier. The patterns are defined in the files StandardFilenamePatterns.txt and
+UserDefinedFilenamePatterns.txt (see the header of StandardFilenamePatterns.txt for their format). User-defined patterns are checked first.
+Any identifier found in this way is only a candidate, and it is validated by the normal metadata lookup (see the module lookup.py).
+'''
+
+import os
+import re
+import pkgutil
+import logging
+from urllib.parse import unquote
+import pdfrenamer.config as config
+
+logger = logging.getLogger("pdf-renamer")
+
+confidence_levels = {'low': 0, 'medium': 1, 'high': 2}
+identifier_types = {'doi': 'DOI', 'arxiv': 'arxiv ID'}
+
+#Number of files checked against the patterns, of files for which at least one pattern matched, and of files for which the
+#identifier derived from the file name was validated. They are used to report the hit rate of the patterns at the end of each run.
+statistics = {'checked': 0, 'matched': 0, 'validated': 0}
+
+_patterns = None
+
+def parse_patterns(text):
+    '''
+    Parses the content of a file of patterns, and returns a list of tuples (identifier_type, confidence, compiled regex, template).
+    Invalid lines are reported and ignored.
+    '''
+    patterns = []
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        fields = line.split()
+        if len(fields) != 4 or fields[0].lower() not in identifier_types or fields[1].lower() not in confidence_levels:
+            logger.error(f"The filename pattern \"{line}\" is not valid, and it will be ignored.")
+            continue
+        try:
+            regex = re.compile(fields[2], re.I)
+        except re.error as e:
+            logger.error(f"The regular expression in the filename pattern \"{line}\" is not valid ({e}), and it will be ignored.")
+            continue
+        patterns.append((identifier_types[fields[0].lower()], fields[1].lower(), regex, fields[3]))
+    return patterns
+
+def load_patterns():
+    '''
+    Returns the list of all patterns (user-defined patterns first), loading them from the files only the first time this function is called.
+    '''
+    global _patterns
+    if _patterns is None:
+        _patterns = []
+        for file in ["UserDefinedFilenamePatterns.txt", "StandardFilenamePatterns.txt"]:
+            try:
+                _patterns.extend(parse_patterns(pkgutil.get_data(__name__, file).decode('utf8')))
+            except OSError:
+                pass
+    return _patterns
+
+def reload_patterns():
+    global _patterns
+    _patterns = None
+    return load_patterns()
+
+def find_identifiers_in_filename(filename, min_confidence=None, update_statistics=True):
+    '''
+    Checks the name of the file filename against all patterns.
+
+    Parameters
+    ----------
+    filename : string
+        Path of the pdf file. Only its name (without the extension) is used.
+    min_confidence : string, optional
+        Patterns with a confidence lower than this value are ignored. If not specified, config.get('filename_patterns_min_confidence') is used.
+    update_statistics : boolean, optional
+        If False, the call is not counted in the statistics reported at the end of the run (used e.g. by the module scheduler.py).
+
+    Returns
+    -------
+    list of tuples (identifier, identifier_type, confidence)
+        All the (distinct) candidate identifiers, sorted from the highest to the lowest confidence. The identifier types are the same used by pdf2doi,
+        i.e. 'DOI' or 'arxiv ID'.
+    '''
+    if min_confidence is None:
+        min_confidence = config.get('filename_patterns_min_confidence')
+    name = unquote(os.path.splitext(os.path.basename(filename))[0]).strip()
+    #Browsers add suffixes like " (1)" to files downloaded more than once
+    name = re.sub(r'\s*\(\d+\)$', '', name)
+    if update_statistics:
+        statistics['checked'] = statistics['checked'] + 1
+    candidates = []
+    for identifier_type, confidence, regex, template in load_patterns():
+        if confidence_levels[confidence] < confidence_levels.get(min_confidence, 0):
+            continue
+        match = regex.fullmatch(name)
+        if not match:
+            continue
+        identifier = match.expand(template)
+        if identifier_type == 'DOI':
+            identifier = identifier.lower()
+        if not any(identifier == c[0] for c in candidates):
+            candidates.append((identifier, identifier_type, confidence))
+    if candidates and update_statistics:
+        statistics['matched'] = statistics['matched'] + 1
+    candidates.sort(key=lambda c: -confidence_levels[c[2]])
+    return candidates
+
+def report_statistics():
+    '''
+    Logs the hit rate of the filename patterns since the beginning of the run.
+    '''
+    if statistics['checked'] == 0:
+        return
+    logger.info(f"Filename patterns: {statistics['matched']} out of {statistics['checked']} file name(s) matched a pattern " +
+                f"({100 * statistics['matched'] / statistics['checked']:.1f}%), and for {statistics['validated']} of them the identifier was validated.")
+
+def add_filename_patterns(path_patterns_file):
+    #Adds the content of the text file specified by the path path_patterns_file at the beginning of the file UserDefinedFilenamePatterns.txt
+    if not(os.path.exists(path_patterns_file)):
+        logger.error(f"{path_patterns_file} is not a valid path to a file.")
+        return
+
+    logger.info(f"Loading the file {path_patterns_file}...")
+    try:
+        with open(path_patterns_file, 'r') as new_patterns_file:
+            new_patterns = new_patterns_file.read()
+    except Exception as e:
+        logger.error('Some error occured while loading this file: \n '+ str(e))
+        return
+
+    if len(parse_patterns(new_patterns)) == 0:
+        logger.error(f"The file {path_patterns_file} does not contain any valid pattern.")
+        return
+
+    logger.info(f"Adding the content of the file {path_patterns_file} to the user-defined filename patterns...")
+    try:
+        path_current_directory = os.path.dirname(__file__)
+        path_UserDefinedPatterns = os.path.join(path_current_directory, 'UserDefinedFilenamePatterns.txt')
+        with open(path_UserDefinedPatterns, 'r') as UserDefinedPatterns_oldfile:
+            UserDefinedPatterns_old = UserDefinedPatterns_oldfile.read()
+        with open(path_UserDefinedPatterns, 'w') as UserDefinedPatterns_newfile:
+            UserDefinedPatterns_newfile.write( new_patterns )
+            UserDefinedPatterns_newfile.write('\n')
+            UserDefinedPatterns_newfile.write( UserDefinedPatterns_old )
+    except Exception as e:
+        logger.error('Some error occured: \n '+ str(e))
+        return
+    reload_patterns()
+    logger.info(f"The new filename patterns were correctly added.")
@@ -0,0 +1,94 @@
+'''
+This module contains the functions used to retrieve the bibtex data of a paper when its identifier (DOI or arXiv ID) is already known,
+e.g. because it was found by one of the fast paths of pdf-renamer, without calling the full pdf2bib -> pdf2doi pipeline (which would
+first look for the identifier inside the pdf file). The identifier is validated by pdf2doi (which, when web validation is active,
+returns the raw data of the paper) and the data are parsed by pdf2bib, exactly as done by pdf2bib.pdf2bib_singlefile.
+If any local bibliography is loaded (see the module bib_index.py), the identifier is first looked for in the local bibliographies, and
+the remote resolvers are used only if it is not found there. If the data of the identifier were already retrieved in a batch request
+(see the module batch_fetch.py), they are used instead of sending a new request.
+'''
+
+import logging
+import pdf2doi
+import pdf2bib
+import pdfrenamer.bib_index as bib_index
+import pdfrenamer.batch_fetch as batch_fetch
+import pdfrenamer.metrics as metrics
+
+logger = logging.getLogger("pdf-renamer")
+
+def lookup_identifier(identifier, identifier_type, filename=None, method=None):
+    '''
+    Retrieves the bibtex data associated to a known identifier.
+
+    Parameters
+    ----------
+    identifier : string
+        A DOI or an arXiv ID
+    identifier_type : string
+        Either 'DOI' or 'arxiv ID' (i.e. the same values used by pdf2doi)
+    filename : string, optional
+        Path of the pdf file the identifier belongs to. It is only stored in the output.
+    method : string, optional
+        Description of how the identifier was found. It is only stored in the output.
+
+    Returns
+    -------
+    result : dictionary
+        A dictionary with the same keys of the one returned by pdf2bib.pdf2bib_singlefile. If the identifier could not be validated,
+        result['metadata'] is None. If the validation failed because it was not possible to connect to the resolver, result['validation_info'] is None.
+        If the metadata were found in a local bibliography, result['metadata_source'] contains its path.
+    '''
+    result = {'identifier': identifier, 'identifier_type': identifier_type, 'path': filename, 'method': method,
+              'validation_info': None, 'metadata': None, 'bibtex': None}
+    if use_local_metadata(result):
+        return result
+
+    what = 'arxiv' if identifier_type == 'arxiv ID' else 'doi'
+    validation_info = batch_fetch.get(identifier, identifier_type)
+    if validation_info is None:
+        with metrics.lookup_seconds.time(backend='pdf2doi'):
+            validation_info = pdf2doi.validate(identifier, what=what)
+        metrics.lookups.inc(backend='pdf2doi', result='hit' if isinstance(validation_info, (str, dict)) else 'miss')
+    result['validation_info'] = validation_info
+    if not (isinstance(validation_info, str) or isinstance(validation_info, dict)):
+        #validation_info is None when it was not possible to connect to the resolver, False if the identifier is not valid,
+        #and True if the identifier is valid but web validation is disabled (and thus no data about the paper are available)
+        return result
+
+    metadata = parse_validation_info(validation_info, identifier_type)
+    if metadata:
+        result['metadata'] = metadata
+        result['bibtex'] = pdf2bib.make_bibtex(metadata)
+    return result
+
+def parse_validation_info(validation_info, identifier_type):
+    '''
+    Converts the raw data returned by pdf2doi when validating an identifier into a dictionary of bibtex data, by calling the proper parser of pdf2bib.
+    Returns None if the data could not be parsed.
+    '''
+    try:
+        if identifier_type == 'arxiv ID':
+            return pdf2bib.parse_bib_from_exportarxivorg(validation_info)
+        return pdf2bib.parse_bib_from_dxdoiorg(validation_info, method=pdf2doi.config.get('method_dxdoiorg'))
+    except Exception as e:
+        logger.error(f"Some error occured while parsing the data retrieved for this identifier: {e}")
+        return None
+
+def use_local_metadata(result):
+    '''
+    Looks for the identifier result['identifier'] in the local bibliographies (see the module bib_index.py). If it is found, result['metadata'] and
+    result['bibtex'] are replaced by the local data, result['metadata_source'] is set to the path of the bibliography, and True is returned.
+    '''
+    if not (bib_index.is_active() and result.get('identifier')):
+        return False
+    with metrics.lookup_seconds.time(backend='local'):
+        metadata, source = bib_index.lookup_identifier(result['identifier'], result.get('identifier_type'))
+    metrics.lookups.inc(backend='local', result='hit' if metadata else 'miss')
+    if not metadata:
+        return False
+    logger.info(f"The identifier {result['identifier']} was found in the local bibliography {source}, whose data will be used.")
+    result['metadata'] = metadata
+    result['bibtex'] = pdf2bib.make_bibtex(metadata)
+    result['metadata_source'] = source
+    return True
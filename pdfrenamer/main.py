@@ -9,51 +9,79 @@ import pdf2doi
 #import itertools
 #import pkgutil
 import pdfrenamer.config as config
-from pdfrenamer.filename_creators import build_filename, AllowedTags, check_format_is_valid
+from pdfrenamer.filename_creators import build_filename, AllowedTags, check_format_is_valid, abbreviations_cache
+import pdfrenamer.retry_queue as retry_queue
+import pdfrenamer.duplicates as duplicates
+from pdfrenamer.results import RenameResult
+import pdfrenamer.preflight as preflight
+import pdfrenamer.lookup as lookup
+import pdfrenamer.filename_patterns as filename_patterns
+import pdfrenamer.workers as workers
+import pdfrenamer.scheduler as scheduler
+import pdfrenamer.work_queue as work_queue
+import pdfrenamer.bib_index as bib_index
+import pdfrenamer.title_matcher as title_matcher
+import pdfrenamer.batch_fetch as batch_fetch
+import pdfrenamer.metrics as metrics
+import pdfrenamer.profiler as profiler
+import pdfrenamer.snapshot as snapshot
 import traceback
 import sys
+import time
 
-#We tell pdf2doi and pdf2bib to use the same value of save_identifier_metadata specified in the settings of pdf-renamer. When pdf-renamer is called via command line, 
-#the value of save_identifier_metadata (for both pdf2doi, pdf2bib and pdf-renamer) might get changed
-pdf2doi.config.set('save_identifier_metadata',config.get('add_metadata')) 
-pdf2bib.config.set('save_identifier_metadata',config.get('add_metadata'))  
+#pdf2doi and pdf2bib never write into the pdf files. When config.get('add_metadata') is True, the identifier found by pdf2doi is stored by pdf-renamer
+#together with the filename format and the metadata snapshot (see the function apply_new_filename), so that each file is rewritten only once
+pdf2doi.config.set('save_identifier_metadata',False) 
+pdf2bib.config.set('save_identifier_metadata',False)  
 
 logger = logging.getLogger("pdf-renamer")
 
-def rename(target, format=None, tags=None):
+def rename(target, format=None, tags=None, keep_metadata=False):
     '''
     This is the main routine of the script. When the library is used as a command-line tool (via the entry-point "pdfrenamer") the input arguments
     are collected, validated and sent to this function (see the function main () below). 
     The function tries to rename the pdf file whose path is specified in the input argument target with the format specified in the input 
     argument format. The info of the paper (title, authors, etc.) are obtained via the library pdf2bib (which in turns uses pdf2doi). 
     If the input argument target is the path of a folder, the function is applied to each pdf file contained in the folder
-    (by calling again the same function). If the global settingcheck_subfolders is set to True, it also renames pdf files in all subfolders (recursively).
+    (via the function rename_files). If the global settingcheck_subfolders is set to True, it also renames pdf files in all subfolders (recursively).
 
     Parameters
     ----------
-    target : string
-        Relative or absolute path of the target .pdf file or directory
+    target : string or list of strings
+        Relative or absolute path of the target .pdf file or directory, or a list of such paths
+    keep_metadata : boolean, optional
+        If False (default), the bulky fields validation_info, bibtex and path are dropped from each result (i.e. they are set to None), and result['metadata'] 
+        only contains the fields needed to build the filename (year, month, day, journal, authors, title). This reduces the memory used when processing 
+        a large number of files. Use keep_metadata=True if these fields are needed (e.g. to save the bibtex entries with pdf2bib.save_bibtex_entries).
     Returns
     -------
-    results, dictionary or list of dictionaries (or None if an error occured)
-        The output is a single dictionary if target is a file, or a list of dictionaries if target is a directory, 
-        each element of the list describing one file. Each dictionary has the following keys
+    results, RenameResult or list of RenameResult (or None if an error occured)
+        The output is a single RenameResult object if target is a file, or a list of RenameResult objects if target is a directory or a list of paths, 
+        each element of the list describing one file. RenameResult objects (see the module results.py) can be accessed as dictionaries, and have the following keys
         result['path_original']     = path of the pdf file (with the original filename)
         result['path_new']          = path of the pdf file, with the new filename, or None if it was not possible to generate a new filename
         result['identifier']        = DOI or other identifier (or None if nothing is found)
         result['identifier_type']   = String specifying the type of identifier (e.g. 'doi' or 'arxiv')
         result['validation_info']   = Additional info on the paper. If config.get('webvalidation') = True, then result['validation_info']
                                       will typically contain raw bibtex data for this paper. Otherwise it will just contain True 
-        result['path']              = Path of the pdf file
+                                      (None if keep_metadata=False)
+        result['path']              = Path of the pdf file (None if keep_metadata=False)
         result['method']            = Method used by pdf2doi to find the identifier
         result['metadata']          = Dictionary containing bibtex info
-        result['bibtex']            = A string containing a valid bibtex entry
+        result['bibtex']            = A string containing a valid bibtex entry (None if keep_metadata=False)
+        result['failure']           = None if the file was processed successfully, otherwise either 'transient' (e.g. network errors, 
+                                      it makes sense to try again later), 'permanent' (e.g. no identifier could be found), 'timeout' or 'oom'
+                                      (the file exceeded the time or memory limit set by config.get('file_timeout') or config.get('file_max_mem'))
+        result['error']             = String describing the error, if any
 
     '''
     
     # Setup logging
     logger = logging.getLogger("pdf-renamer")
 
+    #Failed connections to the resolvers are counted, so that the files affected by them are classified as transient failures (see the module retry_queue.py)
+    retry_queue.monitor_connections()
+
     if not format: format = config.get('format')
     
     #Make some sanity check on the format, and extract tags
@@ -63,125 +91,485 @@ def rename(target, format=None, tags=None):
         if tags == None: #if the function check_format_is_valid has returned, then the format is not valid and the function terminates
             return None
 
+    #Check if target is a list of paths. In this case all pdf files contained in any of the paths are collected (each file is considered only once, even
+    #if it appears in more than one path) and they are processed together
+    if isinstance(target, (list, tuple)):
+        pdf_files = collect_pdf_files(target)
+        if not pdf_files:
+            return []
+        return rename_files(pdf_files, format=format, tags=tags, keep_metadata=keep_metadata)
+
     #Check if path is valid
     if not(os.path.exists(target)):
         logger.error(f"{target} is not a valid path to a file or a directory.")
         return
     
     #Check if target is a directory
-        # If yes, we look for all the .pdf files inside it, and for each of them
-        # we call again this function by passing the file path as target.
-        #
-        # Moreover, if config.get('check_subfolders')==True, for each subfolder in the directory we call again this function
-        # by passsing the subfolder as target
+        # If yes, we look for all the .pdf files inside it (and, if config.get('check_subfolders')==True, inside all its subfolders),
+        # and we process all of them together via the function rename_files. Processing all files together allows to detect 
+        # byte-identical copies of the same file, and to look up only one of them.
 
     if  os.path.isdir(target):
-        logger.info(f"Looking for pdf files and subfolders in the folder {target}...")
-        if not(target.endswith(os.path.sep)): #Make sure the path ends with "\" or "/" (according to the OS)
-                target = target + os.path.sep
-
-        #We build a list of all the pdf files in this folder, and of all subfolders
-        pdf_files = [f for f in os.listdir(target) if (f.lower()).endswith('.pdf')]
-        subfolders = [ f.path for f in os.scandir(target) if f.is_dir() ]
-
-        numb_files = len(pdf_files)
-        if numb_files == 0:
-            logger.error("No pdf file found in this folder.")
-        else:
-            logger.info(f"Found {numb_files} pdf file(s).")
-
-            files_processed = [] #For each pdf file in the target folder we will store a dictionary inside this list
-            for f in pdf_files:
-                logger.info(f"................") 
-                file = target + f
-                #We call again this same function but this time targeting the single file
-                result = rename(file, format=format, tags=tags)
-                files_processed.append(result)
-            logger.info("................") 
-
-        #If there are subfolders, and if config.get('check_subfolders')==True, we call gain this function for each subfolder
-        numb_subfolders = len(subfolders)
-        if numb_subfolders:
-            logger.info(f"Found {numb_subfolders} subfolder(s)")
-            if config.get('check_subfolders')==True :
-                logger.info("Exploring subfolders...") 
-                for subfolder in subfolders:
-                    result = rename(subfolder, format=format,tags=tags)
-                    files_processed.extend(result)
-            else:
-                logger.info("The subfolder(s) will not be scanned because the parameter check_subfolders is set to False."+
-                            " When using this script from command line, use the option -sf to explore also subfolders.") 
-            logger.info("................") 
-        return files_processed
+        pdf_files = find_pdf_files(target)
+        if not pdf_files:
+            return []
+        return rename_files(pdf_files, format=format, tags=tags, keep_metadata=keep_metadata)
     
     #If target is not a directory, we check that it is an existing file and that it ends with .pdf
     else:
-        filename = target
-        logger.info(f"File: {filename}")  
-        if not os.path.exists(filename):
-            logger.error(f"'{filename}' is not a valid file or directory.")
-            return None    
-        if not (filename.lower()).endswith('.pdf'):
-            logger.error("The file must have .pdf extension.")
-            return None
+        started = time.perf_counter()
+        with profiler.sample():
+            result = rename_single_file(target, format, tags, keep_metadata)
+        metrics.file_seconds.observe(time.perf_counter() - started)
+        metrics.files_processed.inc(outcome=outcome(result))
+        return result
 
-        if check_if_file_was_already_renamed_with_same_format(filename,format)==True and config.get('force_rename')==False:
-            logger.info(f"Based on the pdf metadata, this file has been already renamed by pdf-renamer, and with the same filename format. " + 
-                        "Nothing will be done. To overrule this behavior add the command -fr to the pdf-renamer invokation.")
-            result = dict()
-            result['identifier'] = 'previously_found'
-            result['path_original'] = filename
-            result['path_new'] = filename
-            return result
-        
-        #We use the pdf2bib library to retrieve info of this file
-        logger.info(f"Calling the pdf2bib library to retrieve the bibtex info of this file.")
+def rename_single_file(filename, format, tags, keep_metadata=False):
+    '''
+    Renames the single pdf file filename. See the function rename for the meaning of the input arguments and of the output.
+    '''
+    logger.info(f"File: {filename}")  
+    if not os.path.exists(filename):
+        logger.error(f"'{filename}' is not a valid file or directory.")
+        return None    
+    if not (filename.lower()).endswith('.pdf'):
+        logger.error("The file must have .pdf extension.")
+        return None
+
+    #Candidate identifiers are derived from the file name before reading the file (see the module filename_patterns.py)
+    filename_candidates = []
+    if config.get('filename_patterns'):
+        filename_candidates = filename_patterns.find_identifiers_in_filename(filename)
+
+    #Preflight check: the file is memory-mapped and scanned for a DOI/arXiv ID stored in plain bytes (see the module preflight.py)
+    sniffed = {'is_pdf': True, 'identifier': None, 'confidence': None}
+    if config.get('preflight'):
         try:
-            result = pdf2bib.pdf2bib_singlefile(filename)
+            sniffed = preflight.sniff_identifier(filename)
+        except Exception as e:
+            logger.error(f"Some error occured during the preflight check of this file: {e}")
+        if not sniffed['is_pdf']:
+            logger.error("This file does not start with a valid pdf header, and it will be skipped.")
+            return RenameResult(identifier=None, path_original=filename, path_new=None, failure='permanent', error='Not a valid pdf file')
+
+    if check_if_file_was_already_renamed_with_same_format(filename,format)==True and config.get('force_rename')==False:
+        logger.info(f"Based on the pdf metadata, this file has been already renamed by pdf-renamer, and with the same filename format. " + 
+                    "Nothing will be done. To overrule this behavior add the command -fr to the pdf-renamer invokation.")
+        result = RenameResult()
+        result['identifier'] = 'previously_found'
+        result['path_original'] = filename
+        result['path_new'] = filename
+        result['failure'] = None
+        return result
+    
+    result = None
+    connection_failures = retry_queue.connection_failures
+    connection_failed = False #Set to True if any resolver could not be reached while processing this file
+    try:
+        #If the file name matched any of the filename patterns, we validate the corresponding identifiers by retrieving their bibtex data
+        for identifier, identifier_type, confidence in filename_candidates:
+            logger.info(f"The file name matches a pattern for the identifier {identifier} ({identifier_type}, {confidence} confidence). Retrieving its bibtex data directly...")
+            result = lookup.lookup_identifier(identifier, identifier_type, filename, method='filename pattern')
+            if result['metadata']:
+                filename_patterns.statistics['validated'] = filename_patterns.statistics['validated'] + 1
+                break
+            logger.info("It was not possible to retrieve the bibtex data for this identifier.")
+            #validation_info is None when the resolver could not be reached, and False when the identifier is not valid
+            connection_failed = connection_failed or (result['validation_info'] is None and pdf2doi.config.get('webvalidation'))
+            result = None
+
+        #If the preflight check found a reliable identifier, we retrieve the bibtex data directly, without extracting the text of the pdf file
+        if result is None and sniffed['identifier'] and sniffed['confidence'] == 'high':
+            logger.info(f"The preflight check found the identifier {sniffed['identifier']} ({sniffed['identifier_type']}) in the {sniffed['source']} of this file. " +
+                        "Retrieving its bibtex data directly...")
+            result = lookup.lookup_identifier(sniffed['identifier'], sniffed['identifier_type'], filename, method='preflight (' + sniffed['source'] + ')')
+            if not result['metadata']:
+                logger.info("It was not possible to retrieve the bibtex data for this identifier. The full search will be performed.")
+                connection_failed = connection_failed or (result['validation_info'] is None and pdf2doi.config.get('webvalidation'))
+                result = None
+
+        #If any local bibliography is loaded, pdf2doi first looks for an identifier without querying the resolvers (nor searching the web). The identifier
+        #is looked for in the local bibliographies, and the resolvers are queried only if it is not found there, so that a local library can be renamed offline
+        searched_offline = False
+        if result is None and bib_index.is_active():
+            logger.info(f"Calling the pdf2bib library to look for an identifier in this file, without querying the online resolvers.")
+            with metrics.lookup_seconds.time(backend='pdf2bib'):
+                result = workers.extract(filename, online=False)
+            searched_offline = True
+            if result['identifier']:
+                result = lookup.lookup_identifier(result['identifier'], result['identifier_type'], filename, method=result['method'])
+                if not result['metadata']:
+                    logger.info("It was not possible to retrieve the bibtex data for this identifier.")
+                    connection_failed = connection_failed or (result['validation_info'] is None and pdf2doi.config.get('webvalidation'))
+                if result['validation_info'] is False:
+                    #The identifier is not valid (e.g. it belongs to a paper cited in the file), so we let pdf2doi validate all candidates online
+                    logger.info("The identifier is not valid. The full search will be performed.")
+                    result = None
+
+        #We use the pdf2bib library to retrieve info of this file
+        if result is None:
+            logger.info(f"Calling the pdf2bib library to retrieve the bibtex info of this file.")
+            with metrics.lookup_seconds.time(backend='pdf2bib'):
+                result = workers.extract(filename)
+            metrics.lookups.inc(backend='pdf2bib', result='hit' if result.get('metadata') else 'miss')
+            #The local bibliographies (if any) take precedence over the data retrieved by pdf2bib, and they can also provide the data when pdf2bib 
+            #found an identifier but could not retrieve its data
+            lookup.use_local_metadata(result)
+            searched_offline = False
+        result['path_original'] = filename
+        result['failure'] = None
+
+        #If no identifier was found, we look for an entry of the local bibliographies (if any) whose title matches the text of the file
+        if not result['identifier'] and bib_index.is_active():
+            logger.info("Looking for an entry of the local bibliographies whose title matches the text of this file...")
+            match = title_matcher.match_file(filename)
+            if match and match['accepted']:
+                logger.info(f"The title of this file matches the entry \"{match['metadata']['title']}\" of the local bibliography {match['source']} (score {match['score']:.2f}).")
+                title_matcher.apply_match(result, match)
+            elif match:
+                logger.info(f"The title of this file is similar to the entry \"{match['metadata']['title']}\" of the local bibliography {match['source']} " + 
+                            f"(score {match['score']:.2f}), but the match is not reliable enough to be used.")
+                result['title_match'] = f"\"{match['metadata']['title']}\" (score {match['score']:.2f}, {match['source']})"
+
+        #If no identifier was found without querying the resolvers, and the title does not match any local entry, pdf2doi can still search the web
+        if searched_offline and not result['identifier'] and pdf2doi.config.get('websearch'):
+            logger.info(f"Calling the pdf2bib library to search the web for the identifier of this file.")
+            title_match = result.get('title_match')
+            with metrics.lookup_seconds.time(backend='pdf2bib'):
+                result = workers.extract(filename)
+            metrics.lookups.inc(backend='pdf2bib', result='hit' if result.get('metadata') else 'miss')
+            lookup.use_local_metadata(result)
             result['path_original'] = filename
+            result['failure'] = None
+            if title_match and not result['identifier']:
+                result['title_match'] = title_match
 
-            #if pdf2bib was able to find an identifer, and thus to retrieve the bibtex data, we use them to rename the file
-            if result['metadata'] and result['identifier']:
-                logger.info(f"Found bibtex data and an identifier for this file: {result['identifier']} ({result['identifier_type']}).")
-                metadata = result['metadata'].copy()
-                metadata_string = "\n\t"+"\n\t".join([f"{key} = \"{metadata[key]}\"" for key in metadata.keys()] ) 
-                logger.info("Found the following data:" + metadata_string)
-
-                #Generate the new name by calling the function build_filename
-                NewName = build_filename(metadata, format, tags)
-                ext = os.path.splitext(filename)[-1].lower() #Extract the file extension from the old file name
-                directory = pathlib.Path(filename).parent
-                NewPath = str(directory) + os.path.sep + NewName
-                NewPathWithExt = NewPath + ext
-                logger.info(f"The new file name is {NewPathWithExt}")
-                if (filename==NewPathWithExt):
-                    logger.info("The new file name is identical to the old one. Nothing will be changed")
-                    pdf2doi.add_metadata(filename,'/pdfrenamer_nameformat',format)
-                    result['path_new'] = NewPathWithExt
-                else:
-                    try:
-                        NewPathWithExt_renamed = rename_file(filename,NewPath,ext) 
-                        logger.info(f"File renamed correctly.")
-                        if config.get('add_metadata') == True:
-                            pdf2doi.add_metadata(NewPathWithExt_renamed ,'/pdfrenamer_nameformat',format)
-                        if not (NewPathWithExt == NewPathWithExt_renamed):
-                            logger.info(f"(Note: Another file with the same name was already present in the same folder, so a numerical index was added at the end).")
-                        result['path_new'] = NewPathWithExt_renamed
-                    except Exception as e: 
-                        logger.error('Some error occured while trying to rename this file: \n '+ str(e))
-                        result['path_new'] = None
+        #if pdf2bib was able to find an identifer, and thus to retrieve the bibtex data, we use them to rename the file
+        if result['metadata'] and result['identifier']:
+            logger.info(f"Found bibtex data and an identifier for this file: {result['identifier']} ({result['identifier_type']}).")
+            metadata = result['metadata'].copy()
+            metadata_string = "\n\t"+"\n\t".join([f"{key} = \"{metadata[key]}\"" for key in metadata.keys()] ) 
+            logger.info("Found the following data:" + metadata_string)
+
+            try:
+                result['path_new'] = apply_new_filename(filename, metadata, format, tags, identifier=identifier_to_store(result))
+            except Exception as e: 
+                logger.error('Some error occured while trying to rename this file: \n '+ str(e))
+                result['path_new'] = None
+                result['failure'] = 'permanent'
+                result['error'] = str(e)
+        else:
+            if result['identifier']:
+                logger.info("An identifier was found for this pdf file, but it was not possible to retrieve its bibtex data.")
+                result['error'] = "No bibtex data could be retrieved for the identifier " + str(result['identifier'])
+                if config.get('add_metadata') == True and not (result.get('method') == "document_infos"):
+                    #The identifier is stored anyway, so that it is found by the preflight check when the file is processed again
+                    snapshot.add_metadata(filename, {snapshot.identifier_key: result['identifier']})
             else:
                 logger.info("The pdf2doi library was not able to find an identifier for this pdf file.")
-                result['path_new'] = None
-        except Exception as e: 
-            print(traceback.format_exc())
-            # or
-            print(sys.exc_info()[2])
-            logger.error('Some unexpected error occured while using pdf2bib to process this file: \n '+ str(e))
+                result['error'] = "No identifier found"
             result['path_new'] = None
+            connection_failed = connection_failed or retry_queue.connection_failures > connection_failures
+            if connection_failed:
+                logger.info("It was not possible to connect to some of the resolvers while processing this file, so it will be retried later.")
+                result['error'] = result['error'] + " (some resolvers could not be reached)"
+            result['failure'] = retry_queue.classify_failure(result=result, connection_failed=connection_failed)
+    except workers.ExtractionFailed as e:
+        logger.error('The processing of this file was interrupted: '+ str(e))
+        result = {'identifier': None, 'path_original': filename, 'path_new': None, 'failure': e.failure, 'error': str(e)}
+    except Exception as e: 
+        print(traceback.format_exc())
+        # or
+        print(sys.exc_info()[2])
+        logger.error('Some unexpected error occured while using pdf2bib to process this file: \n '+ str(e))
+        if result is None:
+            result = {'identifier': None}
+        result['path_original'] = filename
+        result['path_new'] = None
+        result['failure'] = retry_queue.classify_failure(exception=e)
+        result['error'] = str(e)
+
+    return RenameResult.from_dict(result, keep_metadata=keep_metadata)
 
-        return result 
+def outcome(result):
+    #Returns a short string describing the outcome of the processing of a file, used as label of the metric pdfrenamer_files_processed_total
+    if not result:
+        return 'invalid'
+    if result.get('failure'):
+        return result['failure']
+    if result.get('identifier') == 'previously_found':
+        return 'already_renamed'
+    return 'renamed' if result.get('path_new') != result.get('path_original') else 'unchanged'
+
+def find_pdf_files(folder):
+    '''
+    Returns a list with the paths of all pdf files contained in the input folder. If config.get('check_subfolders')==True, it also
+    looks (recursively) inside all subfolders.
+    '''
+    logger.info(f"Looking for pdf files and subfolders in the folder {folder}...")
+    if not(folder.endswith(os.path.sep)): #Make sure the path ends with "\" or "/" (according to the OS)
+            folder = folder + os.path.sep
 
+    #We build a list of all the pdf files in this folder, and of all subfolders
+    pdf_files = [folder + f for f in os.listdir(folder) if (f.lower()).endswith('.pdf')]
+    subfolders = [ f.path for f in os.scandir(folder) if f.is_dir() ]
+
+    numb_files = len(pdf_files)
+    if numb_files == 0:
+        logger.error("No pdf file found in this folder.")
+    else:
+        logger.info(f"Found {numb_files} pdf file(s).")
+
+    #If there are subfolders, and if config.get('check_subfolders')==True, we call again this function for each subfolder
+    numb_subfolders = len(subfolders)
+    if numb_subfolders:
+        logger.info(f"Found {numb_subfolders} subfolder(s)")
+        if config.get('check_subfolders')==True :
+            logger.info("Exploring subfolders...") 
+            for subfolder in subfolders:
+                pdf_files.extend(find_pdf_files(subfolder))
+        else:
+            logger.info("The subfolder(s) will not be scanned because the parameter check_subfolders is set to False."+
+                        " When using this script from command line, use the option -sf to explore also subfolders.") 
+    return pdf_files
+
+def collect_pdf_files(targets):
+    '''
+    Returns a list with the paths of all pdf files specified by the input list targets, where each element is either the path of a pdf file or
+    the path of a folder (see the function find_pdf_files). Files which are specified more than once (e.g. because a folder and one of its 
+    subfolders are both contained in targets) appear only once in the list.
+    '''
+    pdf_files = []
+    seen = set()
+    for target in targets:
+        if os.path.isdir(target):
+            files = find_pdf_files(target)
+        elif os.path.isfile(target):
+            if not (target.lower()).endswith('.pdf'):
+                logger.error(f"{target} will be ignored, because the file must have .pdf extension.")
+                continue
+            files = [target]
+        else:
+            logger.error(f"{target} is not a valid path to a file or a directory.")
+            continue
+        for f in files:
+            key = os.path.normcase(os.path.realpath(f))
+            if key in seen:
+                continue
+            seen.add(key)
+            pdf_files.append(f)
+    return pdf_files
+
+def read_nul_delimited_paths(path):
+    '''
+    Reads a list of paths separated by NUL characters from the file specified by path (or from the standard input, if path = '-').
+    '''
+    try:
+        if path == '-':
+            data = sys.stdin.buffer.read()
+        else:
+            with open(path, 'rb') as f:
+                data = f.read()
+    except Exception as e:
+        logger.error(f"Some error occured while reading the list of paths from {path}: {e}")
+        return []
+    return [os.fsdecode(p) for p in data.split(b'\0') if p.strip()]
+
+def rename_files(pdf_files, format=None, tags=None, keep_metadata=False):
+    '''
+    Renames all the pdf files whose paths are contained in the input list pdf_files, by calling the function rename on each of them.
+    Unless config.get('duplicates')=='off', byte-identical copies of the same file are detected before any lookup is done (see the module duplicates.py),
+    and only one representative of each group of copies is looked up. The result obtained for the representative is then reused for all the other copies,
+    which are handled according to the value of config.get('duplicates'):
+        'report'    = the copies are renamed in the same way as the representative (each one in its own folder), and they are listed in the final summary
+        'hardlink'  = each copy is renamed, and replaced by a hard link to the (renamed) representative
+        'skip'      = the copies are left untouched
+    Paths which point to the same file as another path in pdf_files (e.g. hard links) are grouped with the copies of that file, but they are never
+    looked up nor renamed, since renaming the file via one of its paths already renames it. They are only listed in the final summary.
+    
+    The files are processed in the order decided by the scheduling policy config.get('schedule') (see the module scheduler.py).
+
+    Returns a list of RenameResult objects (see the function rename for details, including the meaning of keep_metadata), in the order in which
+    the files were processed. Results of copies contain the additional key 'duplicate_of', which is equal to the original path of the representative.
+    Results of hard links also contain the key 'hard_link_of', which is equal to the path (in pdf_files) of the file they point to.
+    '''
+    if not format: format = config.get('format')
+    if not tags:
+        tags = check_format_is_valid(format)
+        if tags == None:
+            return None
+
+    copies = dict() #Each key of this dictionary is the path of a representative file, and the corresponding value is a list of its copies
+    hard_links = dict()
+    if not config.get('duplicates') == 'off':
+        logger.info(f"Looking for byte-identical copies among the {len(pdf_files)} pdf file(s)...")
+        hard_links = duplicates.find_hard_links(pdf_files)
+        for group in duplicates.find_duplicates(pdf_files):
+            copies[group[0]] = group[1:]
+        numb_copies = sum(len(group) for group in copies.values())
+        if numb_copies:
+            logger.info(f"Found {numb_copies} file(s) which are byte-identical copies of other files. Only one file for each group of copies will be looked up.")
+    is_copy = set(f for group in copies.values() for f in group)
+
+    files_to_process = scheduler.schedule([f for f in pdf_files if f not in is_copy], format=format)
+
+    #When batching is enabled, the identifiers which can be found without parsing the pdf files (i.e. from the file names or by the preflight check) are
+    #collected from the next files to be processed, and their data are retrieved with a single request (see the module batch_fetch.py)
+    fetcher = batch_fetch.get_fetcher() if pdf2doi.config.get('webvalidation') else None
+    prefetched_until = 0
+
+    files_processed = [] #For each pdf file we will store a dictionary inside this list
+    for i, file in enumerate(files_to_process):
+        metrics.files_pending.set(len(files_to_process) - i)
+        if fetcher and i >= prefetched_until:
+            prefetched_until = prefetch_identifiers(fetcher, files_to_process, i)
+        logger.info(f"................") 
+        #We call the function rename targeting the single file
+        result = rename(file, format=format, tags=tags, keep_metadata=keep_metadata)
+        files_processed.append(result)
+        for copy in copies.get(file, []):
+            logger.info(f"................") 
+            files_processed.append(rename_duplicate(copy, result, format, tags, hard_link_of=hard_links.get(copy)))
+    metrics.files_pending.set(0)
+    logger.info("................") 
+    if config.get('filename_patterns'):
+        filename_patterns.report_statistics()
+    return files_processed
+
+def prefetch_identifiers(fetcher, pdf_files, start):
+    '''
+    Collects the identifiers which can be found without parsing the pdf files (i.e. from the file names or by the preflight check) from the files
+    pdf_files[start], pdf_files[start+1], ..., until the BatchFetcher object fetcher is full (see the module batch_fetch.py), and retrieves their data.
+    Identifiers already contained in the local bibliographies are not collected. Returns the index of the first file which was not examined.
+    '''
+    i = start
+    started = time.monotonic()
+    #The time limit also applies when no identifier is found, so that the first file is never delayed by more than config.get('batch_window') seconds
+    while i < len(pdf_files) and not fetcher.is_full() and time.monotonic() - started < config.get('batch_window'):
+        filename = pdf_files[i]
+        i = i + 1
+        identifiers = []
+        if config.get('filename_patterns'):
+            identifiers.extend((identifier, identifier_type) for identifier, identifier_type, _ in 
+                               filename_patterns.find_identifiers_in_filename(filename, update_statistics=False))
+        if config.get('preflight'):
+            try:
+                sniffed = preflight.sniff_identifier(filename)
+            except Exception:
+                sniffed = {'identifier': None}
+            if sniffed['identifier'] and sniffed['confidence'] == 'high':
+                identifiers.append((sniffed['identifier'], sniffed['identifier_type']))
+        for identifier, identifier_type in identifiers:
+            if not (bib_index.is_active() and bib_index.lookup_identifier(identifier, identifier_type)[0]):
+                fetcher.add(identifier, identifier_type)
+    fetcher.flush()
+    return i
+
+def rename_duplicate(filename, result_original, format, tags, hard_link_of=None):
+    '''
+    Processes the file filename, which is a byte-identical copy of the file result_original['path_original'], by reusing the
+    result already obtained for the latter (i.e. without looking up the file again). See the function rename_files for details.
+    If hard_link_of is specified, filename points to the same file as the path hard_link_of (e.g. it is a hard link), and it is left untouched.
+    '''
+    logger.info(f"File: {filename}")  
+    logger.info(f"This file is a byte-identical copy of {result_original['path_original']}, and the data found for that file will be reused.")
+    result = result_original.copy()
+    result['path_original'] = filename
+    result['duplicate_of'] = result_original['path_original']
+    if hard_link_of:
+        #Renaming or rewriting the file via this path would undo, or repeat, what was done via the path hard_link_of
+        logger.info(f"This file is a hard link to {hard_link_of}, and it will be left untouched.")
+        result['hard_link_of'] = hard_link_of
+        result['path_new'] = filename if result_original.get('path_new') else None
+        return result
+    if not result_original.get('path_new') or not result_original.get('metadata'):
+        #Either the original file could not be renamed, or it was not looked up at all (e.g. because it was already renamed). In both cases the copy,
+        #being identical, shares the same fate
+        result['path_new'] = filename if result_original.get('path_new') else None
+        return result
+    if config.get('duplicates') == 'skip':
+        logger.info("This file will be left untouched.")
+        result['path_new'] = filename
+        return result
+    try:
+        if config.get('duplicates') == 'hardlink':
+            result['path_new'] = replace_by_hardlink(filename, result_original['path_new'], result_original['metadata'].copy(), format, tags,
+                                                     identifier=identifier_to_store(result_original))
+        else:
+            result['path_new'] = apply_new_filename(filename, result_original['metadata'].copy(), format, tags, identifier=identifier_to_store(result_original))
+    except Exception as e: 
+        logger.error('Some error occured while trying to rename this file: \n '+ str(e))
+        result['path_new'] = None
+        result['failure'] = 'permanent'
+        result['error'] = str(e)
+    return result
+
+def identifier_to_store(result):
+    #Returns the identifier of result which is stored in the pdf metadata. When a file is matched by title to an entry of a local bibliography without
+    #DOI and arXiv ID, the normalized title is used as identifier (see title_matcher.apply_match), but it is not stored, since pdf2doi would read it as an identifier
+    if result.get('identifier_type') == 'title':
+        return None
+    return result.get('identifier')
+
+def apply_new_filename(filename, metadata, format, tags, identifier=None):
+    '''
+    Generates a new filename for the file filename by calling the function build_filename on the input dictionary metadata, 
+    and renames the file. It returns the new path of the file.
+    The format, a snapshot of the metadata (see the module snapshot.py) and the identifier (if specified) are stored in the pdf metadata 
+    of the file, which is rewritten only once.
+    '''
+    #The snapshot is created before calling build_filename, which might modify metadata (e.g. by truncating the title)
+    entries = {snapshot.nameformat_key: format, snapshot.snapshot_key: snapshot.make_snapshot(metadata)}
+    if identifier and config.get('add_metadata') == True:
+        #The identifier is stored with the same key used by pdf2doi, so that it can be found by the preflight check even after the file is renamed
+        entries[snapshot.identifier_key] = identifier
+    #Generate the new name by calling the function build_filename
+    NewName = build_filename(metadata, format, tags)
+    ext = os.path.splitext(filename)[-1].lower() #Extract the file extension from the old file name
+    directory = pathlib.Path(filename).parent
+    NewPath = str(directory) + os.path.sep + NewName
+    NewPathWithExt = NewPath + ext
+    logger.info(f"The new file name is {NewPathWithExt}")
+    if (filename==NewPathWithExt):
+        logger.info("The new file name is identical to the old one. Nothing will be changed")
+        snapshot.add_metadata(filename, entries)
+        return NewPathWithExt
+    NewPathWithExt_renamed = rename_file(filename,NewPath,ext) 
+    logger.info(f"File renamed correctly.")
+    if config.get('add_metadata') == True:
+        snapshot.add_metadata(NewPathWithExt_renamed, entries)
+    if not (NewPathWithExt == NewPathWithExt_renamed):
+        logger.info(f"(Note: Another file with the same name was already present in the same folder, so a numerical index was added at the end).")
+    return NewPathWithExt_renamed
+
+def replace_by_hardlink(filename, target_path, metadata, format, tags, identifier=None):
+    '''
+    Replaces the file filename by a hard link to the file target_path. The hard link is created in the same folder of filename, 
+    and its name is generated by calling the function build_filename on the input dictionary metadata. It returns the path of the hard link.
+    If it is not possible to create a hard link (e.g. because the two files are on different drives), the file is simply renamed.
+    '''
+    NewName = build_filename(metadata, format, tags)
+    ext = os.path.splitext(filename)[-1].lower()
+    NewPath = str(pathlib.Path(filename).parent) + os.path.sep + NewName
+    i=1
+    while True:
+        NewPathWithExt = NewPath + (f" ({i})" if i>1 else "") + ext
+        if os.path.exists(NewPathWithExt) and not os.path.samefile(NewPathWithExt, filename):
+            i = i+1
+            continue
+        break
+    try:
+        os.link(target_path, NewPathWithExt + '.tmp')
+    except OSError as e:
+        logger.info(f"It was not possible to create a hard link to {target_path} ({e}). The file will be simply renamed.")
+        return apply_new_filename(filename, metadata, format, tags, identifier=identifier)
+    os.replace(NewPathWithExt + '.tmp', NewPathWithExt)
+    if not os.path.samefile(filename, NewPathWithExt):
+        os.remove(filename)
+    logger.info(f"The file was replaced by a hard link {NewPathWithExt} to the file {target_path}.")
+    return NewPathWithExt
+
+@metrics.timed(metrics.rename_seconds)
 def rename_file(old_path,new_path,ext):
     #It attempts to rename the file in old_path with the new name contained in new_path. 
     #If another file with the same name specified by new_path already exists in the same folder, it adds an 
@@ -189,15 +577,65 @@ def rename_file(old_path,new_path,ext):
 
     if not os.path.exists(old_path):
         raise ValueError(f"The file {old_path} does not exist")
+    journal = rename_journal_path(old_path)
+    interrupted = read_rename_journal(journal)
     i=1
     while True:
         New_path = new_path + (f" ({i})" if i>1 else "") + ext
         if os.path.exists(New_path):
+            #If a previous attempt was interrupted between os.link and os.remove below, the file has both names, and the journal contains the new one.
+            #Hard links which were not created by rename_file are never removed, since there is no journal for them
+            if interrupted == os.path.abspath(New_path) and os.path.samefile(old_path, New_path):
+                logger.info(f"A previous attempt to rename this file into {New_path} was interrupted, and it will be completed.")
+                os.remove(old_path)
+                remove_rename_journal(journal)
+                metrics.renames.inc(result='renamed' if i==1 else 'renamed_with_index')
+                return New_path
             i = i+1
             continue
-        else:
+        write_rename_journal(journal, New_path)
+        #When several workers process the same folder (see the module work_queue.py), another process might create a file with the same name
+        #after the check above. Creating a hard link fails if the destination exists, so no file can be overwritten
+        try:
+            os.link(old_path,New_path)
+        except FileExistsError:
+            i = i+1
+            continue
+        except OSError: #Hard links are not supported by this file system
             os.rename(old_path,New_path)
-            return New_path
+        else:
+            os.remove(old_path)
+        remove_rename_journal(journal)
+        metrics.renames.inc(result='renamed' if i==1 else 'renamed_with_index')
+        return New_path
+
+def rename_journal_path(old_path):
+    #Path of the (hidden) journal file written by rename_file before renaming the file old_path, which contains the new path of the file
+    directory, name = os.path.split(os.path.abspath(old_path))
+    return os.path.join(directory, '.' + name + '.pdfrenamer-rename')
+
+def read_rename_journal(journal):
+    try:
+        with open(journal, 'r', encoding='utf-8') as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+def write_rename_journal(journal, new_path):
+    #If the journal cannot be written, the file is renamed anyway. If that rename gets interrupted, the next attempt will simply add a numerical index
+    try:
+        with open(journal, 'w', encoding='utf-8') as f:
+            f.write(os.path.abspath(new_path))
+    except OSError as e:
+        logger.error(f"It was not possible to write the file {journal}: {e}")
+
+def remove_rename_journal(journal):
+    try:
+        os.remove(journal)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logger.error(f"It was not possible to remove the file {journal}: {e}")
 
 def check_if_file_was_already_renamed_with_same_format(filename,format):
     flag = False
@@ -207,6 +645,11 @@ def check_if_file_was_already_renamed_with_same_format(filename,format):
             if '/pdfrenamer_nameformat' in infos.keys():
                 if infos['/pdfrenamer_nameformat'] == format:
                     flag = True
+            #Files renamed with --reformat keep the old format in their metadata (to avoid rewriting them), so the name generated from the snapshot
+            #of the metadata is also compared with the current name
+            if not flag and snapshot.snapshot_key in infos.keys():
+                metadata = snapshot.parse_snapshot(infos[snapshot.snapshot_key])
+                flag = bool(metadata) and has_name_from_snapshot(filename, metadata, format)
             return flag
     except TypeError:
         logger.exception("File processing error")
@@ -214,7 +657,116 @@ def check_if_file_was_already_renamed_with_same_format(filename,format):
     except Exception as e:
         logger.exception(f"File processing error: {e}")
         return None
+
+def has_name_from_snapshot(filename, metadata, format, tags=None):
+    #Checks if the name of the file filename is equal to the one generated by build_filename from the dictionary metadata (possibly followed
+    #by the numerical index added by rename_file when the name was already taken)
+    if not tags:
+        tags = check_format_is_valid(format)
+        if tags == None:
+            return False
+    name = build_filename(dict(metadata), format, tags)
+    stem = os.path.splitext(os.path.basename(filename))[0]
+    if stem == name:
+        return True
+    return stem.startswith(name + " (") and stem.endswith(")") and stem[len(name)+2:-1].isdigit()
+
+def reformat_files(pdf_files, format=None, tags=None):
+    '''
+    Renames the pdf files whose paths are contained in the input list pdf_files with the format format, by using only the snapshot of the metadata 
+    stored in each file when it was renamed earlier (see the module snapshot.py), i.e. without looking for identifiers and without network access.
+    The pdf metadata of the files are not modified. Files which do not contain a snapshot are skipped.
+    Returns a list of RenameResult objects. Files without a snapshot have result['path_new'] = None and result['failure'] = 'permanent'.
+    '''
+    if not format: format = config.get('format')
+    if not tags:
+        tags = check_format_is_valid(format)
+        if tags == None:
+            return None
+    results = []
+    for filename in pdf_files:
+        logger.info(f"................") 
+        logger.info(f"File: {filename}")  
+        result = reformat_file(filename, format, tags)
+        metrics.files_processed.inc(outcome=outcome(result))
+        results.append(result)
+    logger.info("................") 
+    return results
+
+def reformat_file(filename, format, tags):
+    result = RenameResult(identifier=None, path_original=filename, path_new=None, method='snapshot', failure=None)
+    try:
+        metadata = snapshot.read_snapshot(filename)
+        if not metadata:
+            logger.info("This file does not contain a snapshot of its metadata, and it will be skipped.")
+            result['failure'], result['error'] = 'permanent', 'No metadata snapshot'
+            return result
+        if has_name_from_snapshot(filename, metadata, format, tags):
+            logger.info("The name of this file already has the specified format. Nothing will be changed.")
+            result['path_new'] = filename
+            return result
+        NewPath = str(pathlib.Path(filename).parent) + os.path.sep + build_filename(metadata, format, tags)
+        result['path_new'] = rename_file(filename, NewPath, os.path.splitext(filename)[-1].lower())
+        logger.info(f"File renamed as {result['path_new']}")
+    except Exception as e:
+        logger.error('Some error occured while trying to rename this file: \n '+ str(e))
+        result['path_new'] = None
+        result['failure'], result['error'] = 'permanent', str(e)
+    return result
     
+def enqueue_files(folder, path_queue=None):
+    '''
+    Adds all pdf files contained in the folder folder (and, if config.get('check_subfolders')==True, in its subfolders) to the work queue stored in
+    the SQLite database path_queue (see the module work_queue.py). If path_queue is not specified, the file pdfrenamer_queue.sqlite inside folder is used.
+    Files are added in the order decided by the scheduling policy config.get('schedule'), so that workers lease them in the same order.
+    '''
+    if not os.path.isdir(folder):
+        logger.error(f"{folder} is not a valid path to a directory.")
+        return
+    if not path_queue:
+        path_queue = os.path.join(folder, 'pdfrenamer_queue.sqlite')
+    pdf_files = scheduler.schedule(find_pdf_files(folder), largest_first=True)
+    try:
+        queue = work_queue.WorkQueue(path_queue)
+        added = queue.enqueue(pdf_files)
+        counts = queue.counts()
+        queue.close()
+    except Exception as e:
+        logger.error(f"Some error occured while adding the files to the queue {path_queue}: \n " + str(e))
+        return
+    logger.info(f"{added} new file(s) were added to the queue {path_queue} ({len(pdf_files) - added} file(s) were already present).")
+    logger.info("Files in the queue: " + ", ".join(f"{state}: {count}" for state, count in counts.items()) + ".")
+    logger.info(f"Start one or more workers with the command \"pdfrenamer --worker {path_queue}\".")
+
+def start_worker(path_queue):
+    '''
+    Processes the files contained in the work queue stored in the SQLite database path_queue (see the module work_queue.py), until all of them 
+    have been processed (by this or by any other worker).
+    '''
+    if not os.path.isfile(path_queue):
+        logger.error(f"{path_queue} is not a valid path to a work queue.")
+        return
+    format = config.get('format')
+    tags = check_format_is_valid(format)
+    if tags == None:
+        return
+
+    def process_file(path):
+        logger.info(f"................") 
+        return rename(path, format=format, tags=tags)
+
+    try:
+        counts = work_queue.run_worker(path_queue, process_file)
+        queue = work_queue.WorkQueue(path_queue)
+        queue_counts = queue.counts()
+        queue.close()
+    except Exception as e:
+        logger.error(f"Some error occured while processing the queue {path_queue}: \n " + str(e))
+        return
+    print(f"This worker processed {sum(counts.values())} file(s). Succeeded: {counts.get(None, 0)}, failed with a permanent error: {counts.get('permanent', 0)}, " +
+          f"failed with a transient error: {counts.get('transient', 0)}, exceeded the time limit: {counts.get('timeout', 0)}, exceeded the memory limit: {counts.get('oom', 0)}.")
+    print("Files in the queue: " + ", ".join(f"{state}: {count}" for state, count in queue_counts.items()) + ".")
+
 def add_abbreviations(path_abbreviation_file):
     #Adds the content of the text file specified by the path path_abbreviation_file at the beginning of the file UserDefinedAbbreviations.txt
     if not(os.path.exists(path_abbreviation_file)):
@@ -243,6 +795,7 @@ def add_abbreviations(path_abbreviation_file):
     except Exception as e: 
         logger.error('Some error occured: \n '+ str(e))
         return
+    abbreviations_cache.clear()
 
     logger.info(f"The new journal abbreviations were correctly added.")
 
@@ -254,9 +807,16 @@ def main():
                                     formatter_class=argparse.RawTextHelpFormatter)
     parser.add_argument(
                         "path",
-                        help = "Relative path of the pdf file or of a folder.",
+                        help = "Relative path of the pdf file or of a folder. Several paths can be specified, and they will be all processed in the same run.",
                         metavar = "path",
                         nargs = '*')
+    parser.add_argument("--from-file",
+                        help="Read additional paths of pdf files or folders from the file FROM_FILE, in which paths are separated by NUL characters (e.g. the output of \"find ... -print0\").\n"+
+                        "Use '-' to read them from the standard input.",
+                        action="store", dest="from_file", type=str)
+    parser.add_argument("--stdin0",
+                        help="Read additional paths of pdf files or folders from the standard input, separated by NUL characters (e.g. \"find . -name '*.pdf' -print0 | pdfrenamer --stdin0\").",
+                        action="store_true")
     parser.add_argument("-s",
                         "--decrease_verbose",
                         help="Decrease verbosity. By default (i.e. when not using -s), all steps performed by pdf-renamer, pdf2dbib and pdf2doi are documented.",
@@ -293,6 +853,11 @@ def main():
                         help="The content of the text file specified by PATH_ABBREVIATION_FILE will be added to the user list of journal abbreviations.\n"+
                         "Each row of the text file must have the format \'FULL NAME = ABBREVIATION\'.",
                         action="store", dest="path_abbreviation_file", type=str)
+    parser.add_argument(
+                        "-add_filename_patterns_file",
+                        help="The content of the text file specified by PATH_PATTERNS_FILE will be added to the user list of filename patterns, which are used to derive the identifier of a paper\n"+
+                        "directly from the name of its pdf file. Each row of the text file must have the format \'TYPE CONFIDENCE REGEX TEMPLATE\' (see the file StandardFilenamePatterns.txt for details).",
+                        action="store", dest="path_patterns_file", type=str)
     parser.add_argument(
                         "-fr",
                         "--force_rename",
@@ -316,6 +881,91 @@ def main():
                         dest="uninstall_right_click",
                         action="store_true",
                         help="Uninstall the right-click context menu functionalities. NOTE: this feature is only available on Windows, and it needs to be run from a terminal opened with administrator rights.")
+    parser.add_argument("--duplicates",
+                        help=f"Specifies how byte-identical copies of the same pdf file are handled (default={config.get('duplicates')}). Only one file for each group of copies is looked up,\n"+
+                        "and the data found for it are reused for all other copies. Possible values are\n"+
+                        "'report' = the copies are renamed in the same way (each one in its own folder), and listed in the final summary\n"+
+                        "'hardlink' = the copies are renamed and replaced by hard links to the same file\n"+
+                        "'skip' = the copies are left untouched\n"+
+                        "'off' = copies are not detected, and each file is looked up separately.",
+                        action="store", dest="duplicates", type=str, default=config.get('duplicates'))
+    parser.add_argument("--file-timeout",
+                        help=f"Maximum time (in seconds) that can be spent to extract the data of a single file (default={config.get('file_timeout')}, i.e. no limit).\n"+
+                        "When a limit is set, the extraction runs in a separate worker process, which is killed (and replaced) if the limit is exceeded.",
+                        action="store", dest="file_timeout", type=int, default=config.get('file_timeout'))
+    parser.add_argument("--file-max-mem",
+                        help=f"Maximum resident memory (in MB) that can be used to extract the data of a single file (default={config.get('file_max_mem')}, i.e. no limit).\n"+
+                        "When a limit is set, the extraction runs in a separate worker process, which is killed (and replaced) if the limit is exceeded.",
+                        action="store", dest="file_max_mem", type=int, default=config.get('file_max_mem'))
+    parser.add_argument("--worker-max-files",
+                        help=f"Number of files after which each worker process is replaced by a new one, to contain memory leaks (default={config.get('worker_max_files')}).",
+                        action="store", dest="worker_max_files", type=int, default=config.get('worker_max_files'))
+    parser.add_argument("--schedule",
+                        help=f"Specifies the order in which the pdf files are processed (default={config.get('schedule')}). Possible values are\n"+
+                        "'none' = the files are processed in the order in which they are found\n"+
+                        "'size' = the files are processed from the smallest to the largest one\n"+
+                        "'cost' = the files which were already renamed, or whose identifier is already known, are processed first. The other files are processed\n"+
+                        "from the least to the most expensive one (or from the most to the least expensive one when they are added to the work queue with --enqueue),\n"+
+                        "based on their size and number of pages.",
+                        action="store", dest="schedule", type=str, default=config.get('schedule'))
+    parser.add_argument("--bib-source",
+                        help="Path of a local bibliography (a BibTeX file, or a CSL-JSON file with extension .json), e.g. exported by Zotero or JabRef. This option can be used several times.\n"+
+                        "Whenever the identifier of a pdf file is known, its data are first looked for in the local bibliographies, and the remote resolvers are used only if\n"+
+                        "the identifier is not found there. Each bibliography is indexed the first time it is used, and indexed again only when it is modified.",
+                        action="append", dest="bib_sources", type=str)
+    parser.add_argument("--batch-size",
+                        help=f"Maximum number of identifiers whose data are retrieved with a single request to Crossref or export.arxiv.org (default={config.get('batch_size')}).\n"+
+                        "Only identifiers which can be found without reading the whole pdf file (e.g. from the file name) are retrieved in batches. Use 1 to disable batching.",
+                        action="store", dest="batch_size", type=int, default=config.get('batch_size'))
+    parser.add_argument("--batch-window",
+                        help=f"Maximum time (in seconds) spent collecting identifiers for the same batch request (default={config.get('batch_window')}).",
+                        action="store", dest="batch_window", type=int, default=config.get('batch_window'))
+    parser.add_argument("--metrics-port",
+                        help=f"If larger than 0, the metrics of pdf-renamer (e.g. number of processed files, latency of the lookups) are exposed in the Prometheus text format\n"+
+                        f"at http://127.0.0.1:METRICS_PORT/metrics while pdf-renamer runs (default={config.get('metrics_port')}).",
+                        action="store", dest="metrics_port", type=int, default=config.get('metrics_port'))
+    parser.add_argument("--metrics-file",
+                        help="Path of a file where the metrics of pdf-renamer are written in the Prometheus text format (e.g. for the textfile collector of the node exporter).\n"+
+                        "The file is rewritten every METRICS_INTERVAL seconds, and when pdf-renamer ends.",
+                        action="store", dest="metrics_file", type=str)
+    parser.add_argument("--metrics-interval",
+                        help=f"Time (in seconds) between two consecutive updates of the file specified by --metrics-file (default={config.get('metrics_interval')}).",
+                        action="store", dest="metrics_interval", type=int, default=config.get('metrics_interval'))
+    parser.add_argument("--profile",
+                        help="Profile the run, and write the profiling data into the files PREFIX.pstats (statistics of cProfile) and PREFIX.folded (collapsed call stacks,\n"+
+                        "which can be converted into a flame graph), where PREFIX is set by --profile-output. A short report on where the time was spent is printed at the end.",
+                        action="store_true", dest="profile")
+    parser.add_argument("--profile-output",
+                        help="Used together with --profile. Path prefix of the files containing the profiling data (default=pdfrenamer_profile).",
+                        action="store", dest="profile_output", type=str, default='pdfrenamer_profile')
+    parser.add_argument("--profile-sample",
+                        help="Used together with --profile. If larger than 0, only one file every PROFILE_SAMPLE files is profiled, instead of the whole run (default=0).",
+                        action="store", dest="profile_sample", type=int, default=0)
+    parser.add_argument("--enqueue",
+                        help="Add all pdf files contained in the folder ENQUEUE (and in its subfolders, if -sf is used) to a durable work queue, without processing them.\n"+
+                        "The files in the queue can then be processed by any number of workers (see --worker), possibly running on different machines which share the same storage.\n"+
+                        "The queue is stored in the file specified by --queue (default: pdfrenamer_queue.sqlite inside the folder ENQUEUE).",
+                        action="store", dest="enqueue", type=str)
+    parser.add_argument("--queue",
+                        help="Path of the SQLite database containing the work queue, used together with --enqueue.",
+                        action="store", dest="queue", type=str)
+    parser.add_argument("--worker",
+                        help="Start a worker which processes the files contained in the work queue WORKER (i.e. the path of the SQLite database created by --enqueue),\n"+
+                        "until all of them have been processed. Several workers can process the same queue at the same time.",
+                        action="store", dest="worker", type=str)
+    parser.add_argument("--lease-time",
+                        help=f"Time (in seconds) after which a file leased by a worker which stopped sending heartbeats (e.g. because it crashed) is given to another worker (default={config.get('queue_lease_time')}).",
+                        action="store", dest="lease_time", type=int, default=config.get('queue_lease_time'))
+    parser.add_argument("--reformat",
+                        dest="reformat",
+                        action="store_true",
+                        help="Rename the target files with the current format by using only the snapshot of the metadata stored in each file when it was renamed earlier,\n"+
+                        "without looking for identifiers and without network access. Files which do not contain a snapshot are skipped and listed at the end.")
+    parser.add_argument("--retry-pending",
+                        dest="retry_pending",
+                        action="store_true",
+                        help=f"Process only the files which previously failed because of a transient error (e.g. network problems) and whose waiting time has expired.\n"+
+                        f"These files are stored in a persistent retry queue, and they are retried with an exponential backoff (the maximum number of attempts is {config.get('retry_max_attempts')}).")
 
     
     args = parser.parse_args()
@@ -340,6 +990,10 @@ def main():
         add_abbreviations(args.path_abbreviation_file)
         return
 
+    if args.path_patterns_file:
+        filename_patterns.add_filename_patterns(args.path_patterns_file)
+        return
+
     if (check_format_is_valid(args.format)):
         config.set('format' , args.format)
 
@@ -365,74 +1019,223 @@ def main():
         logger.error(f"The specified value for case is not valid.")
         return
 
+    if args.duplicates in ['report','hardlink','skip','off']:
+        config.set('duplicates' , args.duplicates)
+    else:
+        logger.error(f"The specified value for duplicates is not valid.")
+        return
+
+    if args.schedule in scheduler.policies:
+        config.set('schedule' , args.schedule)
+    else:
+        logger.error(f"The specified value for schedule is not valid.")
+        return
+
+    for name in ['file_timeout', 'file_max_mem', 'worker_max_files', 'batch_window', 'metrics_port', 'metrics_interval']:
+        if getattr(args, name) >= 0:
+            config.set(name , getattr(args, name))
+        else:
+            logger.error(f"The specified value for {name} is not valid.")
+            return
+
+    if args.metrics_file:
+        config.set('metrics_file' , os.path.abspath(args.metrics_file))
+
     config.set('check_subfolders' , args.sub_folders)
     config.set('force_rename' , args.force_rename)
 
+    if args.bib_sources:
+        config.set('bib_sources' , os.pathsep.join(os.path.abspath(source) for source in args.bib_sources))
+
+    if args.batch_size > 0:
+        config.set('batch_size' , args.batch_size)
+    else:
+        logger.error(f"The specified value for batch_size is not valid.")
+        return
+
+    if args.lease_time > 0:
+        config.set('queue_lease_time' , args.lease_time)
+    else:
+        logger.error(f"The specified value for lease_time is not valid.")
+        return
+
+    if args.profile and args.profile_sample < 0:
+        logger.error(f"The specified value for profile_sample is not valid.")
+        return
+
+    #The settings are stored only after all of them have been validated and set
     if args.set_default:
         logger.info("Storing the settings specified by the user (if any is valid) as default values...")
         config.WriteParamsINIfile()
         logger.info("Done.")
 
+    if config.get('bib_sources'):
+        bib_index.load_sources()
+
+    metrics.start_exporters()
+
+    if args.profile:
+        profiler.configure(os.path.abspath(args.profile_output), args.profile_sample)
+
+    if args.enqueue:
+        enqueue_files(args.enqueue, args.queue)
+        return
+
+    if args.worker:
+        config.set('add_metadata', not (args.readonly))
+        with profiler.session():
+            start_worker(args.worker)
+        return
+
+    if args.retry_pending:
+        queue = retry_queue.RetryQueue()
+        targets = []
+        for f in queue.due():
+            if not os.path.exists(f):
+                logger.info(f"The file {f} does not exist anymore, and it will be removed from the retry queue.")
+                queue.remove(f)
+                continue
+            targets.append(f)
+        queue.save()
+        if not targets:
+            if len(queue)==0:
+                logger.info("The retry queue is empty.")
+            else:
+                logger.info(f"The retry queue contains {len(queue)} file(s), but none of them can be retried yet. " + 
+                            f"The next file will be ready to be retried on {time.ctime(queue.next_due_time())}.")
+            return
+        logger.info(f"Found {len(targets)} file(s) in the retry queue which can be retried now.")
     ## The following block of code (until ##END) is required to make sure that 'path' is considered a required parameter, except for the case when
     ## -install--right--click or -uninstall--right--click are used, or when the user is setting default values for some of the parameters
-    if isinstance(args.path,list):
-        if len(args.path)>0:
-            target = args.path[0]
-        else:
-            target = ""
     else:
-        target = args.path
-    if target == "" and not (args.set_default):
+        targets = args.path if isinstance(args.path,list) else [args.path]
+        if args.stdin0:
+            targets = targets + read_nul_delimited_paths('-')
+        if args.from_file:
+            targets = targets + read_nul_delimited_paths(args.from_file)
+        targets = [t for t in targets if t]
+    if not targets and not (args.set_default or args.stdin0 or args.from_file):
         print("pdfrenamer: error: the following arguments are required: path. Type \'pdfrenamer --h\' for a list of commands.")
-    if target == "": #This occurs either if the user forgot to add a target, or if the user used the -sd command to set default values
+    if not targets: #This occurs either if the user forgot to add a target, or if the user used the -sd command to set default values
         return
     ## END
+
+    if args.reformat:
+        pdf_files = collect_pdf_files(targets)
+        with profiler.session():
+            results = reformat_files(pdf_files)
+        if results == None:
+            return
+        renamed = [result for result in results if result['path_new'] and result['path_new'] != result['path_original']]
+        skipped = [result for result in results if not result['path_new']]
+        for result in renamed:
+            print(f"{result['path_original']}\n---> {result['path_new']}")
+        print(f"{len(renamed)} file(s) renamed, {len(results) - len(renamed) - len(skipped)} file(s) already had the specified format, {len(skipped)} file(s) skipped.")
+        if skipped:
+            print("The following file(s) could not be renamed, because they do not contain a snapshot of their metadata (e.g. because they were renamed with an older version of pdf-renamer). " +
+                  "Run pdf-renamer on them without --reformat:")
+            for result in skipped:
+                print(f"{result['path_original']} ({result.get('error', '')})")
+        return
     
     config.set('add_metadata', not (args.readonly))
-    pdf2doi.config.set('save_identifier_metadata',config.get('add_metadata')) 
-    pdf2bib.config.set('save_identifier_metadata',config.get('add_metadata')) 
 
     if(args.decrease_verbose==True):
         print(f"(All intermediate output will be suppressed. To see additional output, do not use the command -s)")
-    results = rename(target=target)
+    #All targets are processed together, so that files appearing in more than one target are processed only once, and so that copies of the same
+    #file are detected across different targets
+    with profiler.session():
+        results = rename(target=targets if len(targets)>1 else targets[0])
 
     if results==None:  #This typically happens when target is neither a valid file nor a valid directory. In this case we stop
         return         #the script execution here. Proper error messages were raised by the rename function
 
-    if  os.path.isdir(target):
-        target = os.path.join(target, '') #This makes sure that, if target is a path to a directory, it has the ending "/" or "\"
-    MainPath = os.path.dirname(target) #Extract the path of target. If target is a directory, then MainPath = target
+    if not isinstance(results,list):
+        results = [results]
+    results = [result for result in results if result]
+
+    #Files which failed because of a transient error are added to the persistent retry queue, while files which were processed successfully are removed from it
+    retry_queue.update_retry_queue(results)
+
+    #Paths in the summary are printed relative to the deepest folder which contains all targets. If a single folder was targeted, then MainPath = target
+    try:
+        MainPath = os.path.commonpath([os.path.abspath(t) if os.path.isdir(t) else os.path.dirname(os.path.abspath(t)) for t in targets])
+    except ValueError: #This happens on Windows, if the targets are on different drives
+        MainPath = ''
 
     from colorama import init,Fore, Back, Style
     init(autoreset=True)
     print(Fore.RED + "Summaries of changes done:")
 
-    if not isinstance(results,list):
-        results = [results]
-    
     counter = 0
     counter_identifier_notfound = 0
+    counter_succeeded = 0
+    counter_transient = 0
+    counter_permanent = 0
+    counter_timeout = 0
+    counter_oom = 0
 
     for result in results:
-        if result and result['identifier'] and result['path_new']:
+        if result['identifier'] and result['path_new']:
+            counter_succeeded = counter_succeeded + 1
             if not(result['path_original']==result['path_new']):
                 print(Fore.YELLOW + f"{os.path.relpath(result['path_original'],MainPath)}")
                 print(Fore.MAGENTA + f"---> {os.path.relpath(result['path_new'],MainPath)}")
                 counter = counter + 1
-        elif not (result['identifier']): 
-            counter_identifier_notfound = counter_identifier_notfound + 1
+        else:
+            if result.get('failure') == 'transient':
+                counter_transient = counter_transient + 1
+            elif result.get('failure') == 'timeout':
+                counter_timeout = counter_timeout + 1
+            elif result.get('failure') == 'oom':
+                counter_oom = counter_oom + 1
+            else:
+                counter_permanent = counter_permanent + 1
+                if not (result['identifier']): 
+                    counter_identifier_notfound = counter_identifier_notfound + 1
+
+    copies = [result for result in results if result.get('duplicate_of')]
+    if copies:
+        print(Fore.RED + f"The following {len(copies)} file(s) are byte-identical copies of other files. The data found for the original file were reused" +
+              (", and the copy was left untouched:" if config.get('duplicates') == 'skip' else ":"))
+        for result in copies:
+            if result.get('hard_link_of'):
+                print(f"{os.path.relpath(result['path_original'],MainPath)} (hard link to {os.path.relpath(result['hard_link_of'],MainPath)}, left untouched)")
+            else:
+                print(f"{os.path.relpath(result['path_original'],MainPath)} (copy of {os.path.relpath(result['duplicate_of'],MainPath)})")
 
     if counter==0:
         print("No file has been renamed.")
     else:
         print(f"{counter} file" + ("s have " if counter>1 else " has ") + "been renamed.")
+    print(f"Succeeded: {counter_succeeded}, failed with a permanent error: {counter_permanent}, failed with a transient error: {counter_transient}" +
+          (f", exceeded the time limit: {counter_timeout}" if counter_timeout else "") + 
+          (f", exceeded the memory limit: {counter_oom}" if counter_oom else "") + ".")
+    if counter_timeout + counter_oom > 0:
+        print(Fore.RED + f"The following file(s) exceeded the per-file time limit (--file-timeout) or memory limit (--file-max-mem):")
+        for result in results:
+            if result.get('failure') in ['timeout', 'oom']:
+                print(f"{result['path_original']} ({result.get('error', '')})")
+    if counter_transient > 0:
+        print(Fore.RED + f"The {counter_transient} file(s) which failed with a transient error (e.g. network problems) were added to the retry queue. " +
+              "Use the command \"pdfrenamer --retry-pending\" to process them again later.")
+        for result in results:
+            if result.get('failure') == 'transient':
+                print(f"{result['path_original']} ({result.get('error', '')})")
+
+    borderline = [result for result in results if result.get('title_match') and not result['path_new']]
+    if borderline:
+        print(Fore.RED + f"No identifier was found for the following {len(borderline)} file(s), but their title is similar to an entry of the local bibliographies. " +
+              "The matches were not used because their score is below the threshold (title_match_threshold), or because they are ambiguous:")
+        for result in borderline:
+            print(f"{os.path.relpath(result['path_original'],MainPath)} ---> {result['title_match']}")
 
     if counter_identifier_notfound > 0:
         print(Fore.RED +"The following pdf files could not be renamed because it was not possile to automatically find " +
               "the publication identifier (DOI or arXiv ID). Try to manually add a valid identifier to each file via " +
               "the command \"pdf2doi 'filename.pdf' -id 'valid_identifier'\" and then run again pdf-renamer.")  
         for result in results:
-            if not(result['identifier']):
+            if not(result['identifier']) and not result.get('failure') in ['transient', 'timeout', 'oom']:
                 print(f"{result['path_original']}")
     return
 
@@ -0,0 +1,283 @@
+'''
+This module contains a small registry of metrics (counters, gauges and latency histograms), which are updated while pdf-renamer runs and which
+can be exported in the text format used by Prometheus (https://prometheus.io/docs/instrumenting/exposition_formats/), either
+    (1) through a local HTTP endpoint /metrics, started with config.get('metrics_port') > 0 (see the function start_http_server), or
+    (2) by periodically rewriting the text file config.get('metrics_file') (e.g. for the textfile collector of the Prometheus node exporter,
+        see the class TextfileWriter). The file is also written once more when the process ends, so batch jobs always leave their final values.
+All metrics defined at the end of this module are always updated (the cost is negligible compared to the processing of a pdf file), but
+they are exported only if requested.
+'''
+
+import atexit
+import bisect
+import functools
+import os
+import threading
+import time
+import logging
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+import pdfrenamer.config as config
+
+logger = logging.getLogger("pdf-renamer")
+
+#Upper bounds (in seconds) of the buckets of the latency histograms
+default_buckets = (0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+def format_labels(names, values):
+    if not names:
+        return ''
+    return '{' + ','.join(f'{name}="{escape(value)}"' for name, value in zip(names, values)) + '}'
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def format_number(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+class Metric():
+    '''
+    Base class of all metrics. Each metric has a name, a help string and (optionally) a list of label names. The values for each combination
+    of label values are stored separately, and they are created the first time they are used.
+    '''
+    type = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self.values = dict()
+        self.lock = threading.Lock()
+
+    def key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.label_names)
+
+    def expose(self):
+        #Returns the lines of the Prometheus text format for this metric
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        with self.lock:
+            for key, value in sorted(self.values.items()):
+                lines.extend(self.expose_value(key, value))
+        return lines
+
+    def expose_value(self, key, value):
+        return [f"{self.name}{format_labels(self.label_names, key)} {format_number(value)}"]
+
+class Counter(Metric):
+    '''
+    A value which can only increase (e.g. the number of processed files).
+    '''
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels):
+        return self.values.get(self.key(labels), 0)
+
+class Gauge(Metric):
+    '''
+    A value which can go up and down (e.g. the number of files waiting in a queue).
+    '''
+    type = 'gauge'
+
+    def set(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels):
+        return self.values.get(self.key(labels), 0)
+
+class Histogram(Metric):
+    '''
+    Distribution of observed values (e.g. latencies, in seconds), counted in buckets with fixed upper bounds.
+    '''
+    type = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=default_buckets):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            if key not in self.values:
+                self.values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            counts = self.values[key]
+            counts[0][bisect.bisect_left(self.buckets, value)] += 1
+            counts[1] += value
+            counts[2] += 1
+
+    def time(self, **labels):
+        '''
+        Returns a context manager which observes the time spent inside its block, e.g. "with histogram.time(backend='crossref'): ...".
+        '''
+        return _Timer(self, labels)
+
+    def expose_value(self, key, value):
+        buckets, total, count = value
+        lines = []
+        cumulative = 0
+        for bound, n in zip(self.buckets + (float('inf'),), buckets):
+            cumulative += n
+            lines.append(f"{self.name}_bucket{format_labels(self.label_names + ('le',), key + (format_number(bound),))} {cumulative}")
+        lines.append(f"{self.name}_sum{format_labels(self.label_names, key)} {format_number(total)}")
+        lines.append(f"{self.name}_count{format_labels(self.label_names, key)} {count}")
+        return lines
+
+class _Timer():
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+        return False
+
+def timed(histogram, **labels):
+    '''
+    Decorator which observes the execution time of each call of the decorated function in histogram.
+    '''
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - start, **labels)
+        return wrapper
+    return decorator
+
+class Registry():
+    def __init__(self):
+        self.metrics = []
+        self.lock = threading.Lock()
+
+    def register(self, metric):
+        with self.lock:
+            self.metrics.append(metric)
+        return metric
+
+    def expose(self):
+        '''
+        Returns all metrics in the Prometheus text format.
+        '''
+        with self.lock:
+            metrics = list(self.metrics)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.expose())
+        return '\n'.join(lines) + '\n'
+
+registry = Registry()
+
+def counter(name, help, labels=()):
+    return registry.register(Counter(name, help, labels))
+
+def gauge(name, help, labels=()):
+    return registry.register(Gauge(name, help, labels))
+
+def histogram(name, help, labels=(), buckets=default_buckets):
+    return registry.register(Histogram(name, help, labels, buckets))
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = registry.expose().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+def start_http_server(port, address='127.0.0.1'):
+    '''
+    Starts (in a background thread) an HTTP server which exposes all metrics at http://address:port/metrics. Returns the server object.
+    '''
+    server = _Server((address, port), _Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    logger.info(f"The metrics are exposed at http://{address}:{server.server_address[1]}/metrics")
+    return server
+
+class TextfileWriter(threading.Thread):
+    '''
+    Background thread which rewrites the file path with all metrics every interval seconds. The file is replaced atomically, so that a
+    collector never reads a partially written file.
+    '''
+    def __init__(self, path, interval):
+        super().__init__(daemon=True)
+        self.path = path
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def write(self):
+        path_tmp = self.path + '.tmp'
+        try:
+            with open(path_tmp, 'w', encoding='utf-8') as f:
+                f.write(registry.expose())
+            os.replace(path_tmp, self.path)
+        except OSError as e:
+            logger.error(f"It was not possible to write the metrics into the file {self.path}: {e}")
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.write()
+
+    def stop(self):
+        self.stopped.set()
+        self.write()
+
+def start_exporters():
+    '''
+    Starts the exporters requested via config.get('metrics_port') and config.get('metrics_file').
+    '''
+    if config.get('metrics_port') > 0:
+        try:
+            start_http_server(config.get('metrics_port'))
+        except OSError as e:
+            logger.error(f"It was not possible to start the metrics endpoint on port {config.get('metrics_port')}: {e}")
+    if config.get('metrics_file'):
+        writer = TextfileWriter(config.get('metrics_file'), max(config.get('metrics_interval'), 1))
+        writer.start()
+        atexit.register(writer.stop)
+
+#Metrics updated by pdf-renamer
+files_processed = counter('pdfrenamer_files_processed_total', 'Number of pdf files processed, by outcome.', ['outcome'])
+file_seconds = histogram('pdfrenamer_file_processing_seconds', 'Time spent to process a single pdf file.')
+files_pending = gauge('pdfrenamer_files_pending', 'Number of pdf files of the current batch which have not been processed yet.')
+lookups = counter('pdfrenamer_lookups_total', 'Number of metadata lookups, by backend and result (hit or miss).', ['backend', 'result'])
+lookup_seconds = histogram('pdfrenamer_lookup_seconds', 'Latency of metadata lookups, by backend.', ['backend'])
+build_filename_seconds = histogram('pdfrenamer_build_filename_seconds', 'Time spent to build a new filename.')
+journal_abbreviations = counter('pdfrenamer_journal_abbreviation_lookups_total', 'Number of journal abbreviation lookups, by result (found or not_found).', ['result'])
+journal_abbreviation_cache = counter('pdfrenamer_journal_abbreviation_cache_total', 'Number of journal abbreviation lookups answered by the in-memory cache (hit) or by reading the abbreviation files (miss).', ['result'])
+journal_abbreviation_seconds = histogram('pdfrenamer_journal_abbreviation_seconds', 'Time spent to look for the abbreviation of a journal.')
+renames = counter('pdfrenamer_renames_total', 'Number of files renamed, by result (renamed, or renamed with a numerical index because the name was already taken).', ['result'])
+rename_seconds = histogram('pdfrenamer_rename_file_seconds', 'Time spent to rename a file on disk.')
+queue_files = gauge('pdfrenamer_queue_files', 'Number of files in the work queue, by state.', ['state'])
+retry_queue_files = gauge('pdfrenamer_retry_queue_files', 'Number of files in the retry queue.')
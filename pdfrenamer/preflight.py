@@ -0,0 +1,137 @@
+'''
+This module contains a cheap "preflight" check which is performed on each pdf file before calling the full pdf2bib -> pdf2doi pipeline.
+The file is memory-mapped, and a bounded window of bytes at its beginning and at its end is scanned with regular expressions, looking for
+a DOI or an arXiv ID stored in plain (i.e. uncompressed) bytes. Identifiers are looked for in
+    (1) the document info entries '/pdf2doi_identifier' and '/doi' (the first one is added by pdf2doi itself after a successful search)
+    (2) the XMP metadata packet (e.g. <prism:doi>...</prism:doi>)
+    (3) the URIs of link annotations pointing to doi.org or arxiv.org
+Identifiers found in (1) and (2) are considered reliable ('high' confidence), while identifiers found in (3) are not (a paper typically
+contains links to the DOIs of the references too), and they are returned with 'low' confidence.
+The same check also verifies that the file starts with the pdf magic header, so that files with a .pdf extension which are not
+actually pdf files can be discarded immediately.
+'''
+
+import mmap
+import os
+import re
+import logging
+import pdfrenamer.config as config
+
+logger = logging.getLogger("pdf-renamer")
+
+pdf_header = b'%PDF-'
+header_window = 1024 #The pdf header must appear within the first header_window bytes of the file
+
+doi_pattern = re.compile(rb'(10\.\d{4,9}/[-._;()/:a-zA-Z0-9<>]+[a-zA-Z0-9])')
+arxiv_pattern = re.compile(rb'(?:arxiv[\s:]*)?(\d{4}\.\d{4,5})(?:v\d+)?', re.I)
+
+#A pdf string, which is either a literal string (i.e. a sequence of characters delimited by parentheses, in which parentheses can appear if
+#escaped by a backslash) or a hexadecimal string (delimited by < and >)
+_string = rb'(\((?:[^()\\]|\\.){4,400}\)|<[0-9a-fA-F\s]{8,1600}>)'
+
+#Each element of the list is a tuple (source, compiled regex, confidence). The first group of each regex contains the text where the identifier is looked for.
+#Within each confidence level, sources are checked in the order in which they appear in the list.
+identifier_patterns = [
+    ('document info /pdf2doi_identifier',   re.compile(rb'/pdf2doi_identifier\s*' + _string, re.S), 'high'),
+    ('document info /doi',                  re.compile(rb'/doi\s*' + _string, re.S | re.I), 'high'),
+    ('XMP metadata',                        re.compile(rb'<(?:prism|pdfx):doi>\s*([^<]{4,400})</(?:prism|pdfx):doi>', re.I), 'high'),
+    ('XMP metadata',                        re.compile(rb'(?:prism|pdfx):doi\s*=\s*"([^"]{4,400})"', re.I), 'high'),
+    ('XMP metadata',                        re.compile(rb'<dc:identifier>\s*((?:doi:|info:doi/)[^<]{4,400})</dc:identifier>', re.I), 'high'),
+    ('link annotation',                     re.compile(rb'/URI\s*(\(\s*https?://(?:dx\.)?doi\.org/(?:[^()\\]|\\.){4,400}\))', re.I), 'low'),
+    ('link annotation',                     re.compile(rb'/URI\s*(\(\s*https?://arxiv\.org/(?:abs|pdf)/(?:[^()\\]|\\.){4,100}\))', re.I), 'low'),
+]
+
+_escapes = {b'n': b'\n', b'r': b'\r', b't': b'\t', b'b': b'\b', b'f': b'\f', b'(': b'(', b')': b')', b'\\': b'\\'}
+
+def decode_pdf_string(value):
+    '''
+    Decodes the bytes value, which can be either a pdf literal string (including the delimiting parentheses), a pdf hexadecimal string
+    (including the delimiting < and >), or any other text (which is returned unchanged). Escape sequences (including octal codes like \\056, which are 
+    used e.g. by pypdf) are resolved, and strings encoded in UTF-16 are converted to UTF-8.
+    '''
+    if value.startswith(b'<') and value.endswith(b'>'):
+        value = re.sub(rb'\s', b'', value[1:-1])
+        if len(value) % 2:
+            value = value + b'0'
+        value = bytes.fromhex(value.decode('ascii'))
+    elif value.startswith(b'(') and value.endswith(b')'):
+        value = re.sub(rb'\\([0-7]{1,3}|\r\n|[\r\n]|.)', _unescape, value[1:-1], flags=re.S)
+    if value.startswith(b'\xfe\xff'):
+        value = value[2:].decode('utf-16-be', errors='ignore').encode('utf-8')
+    return value
+
+def _unescape(match):
+    code = match.group(1)
+    if code[:1].isdigit():
+        return bytes([int(code, 8) & 0xFF])
+    if code in (b'\r\n', b'\r', b'\n'): #A backslash at the end of a line means that the string continues on the next line
+        return b''
+    return _escapes.get(code, code)
+
+def extract_identifier(value):
+    '''
+    Looks for a DOI or an arXiv ID inside the bytes value. Returns a tuple (identifier, identifier_type), or (None, None) if nothing is found.
+    The identifier types are the same used by pdf2doi, i.e. 'DOI' or 'arxiv ID'.
+    '''
+    value = decode_pdf_string(value)
+    match = doi_pattern.search(value)
+    if match:
+        return match.group(1).decode('latin-1').lower(), 'DOI'
+    match = arxiv_pattern.search(value)
+    if match:
+        return match.group(1).decode('latin-1'), 'arxiv ID'
+    return None, None
+
+def sniff_identifier(filename, window=None):
+    '''
+    Performs the preflight check on the file filename.
+
+    Parameters
+    ----------
+    filename : string
+        Path of the pdf file
+    window : int, optional
+        Number of bytes scanned at the beginning and at the end of the file. If not specified, the value config.get('preflight_window') (in kilobytes) is used.
+
+    Returns
+    -------
+    result : dictionary
+        result['is_pdf']            = False if the file does not start with the pdf magic header, True otherwise
+        result['identifier']        = DOI or arXiv ID found in the file (or None if nothing is found)
+        result['identifier_type']   = Either 'DOI' or 'arxiv ID'
+        result['confidence']        = Either 'high' or 'low' (see the docstring of this module)
+        result['source']            = String describing where the identifier was found
+    '''
+    if window is None:
+        window = config.get('preflight_window') * 1024
+    result = {'is_pdf': False, 'identifier': None, 'identifier_type': None, 'confidence': None, 'source': None}
+    with open(filename, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return result
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if mm.find(pdf_header, 0, header_window) == -1:
+                return result
+            result['is_pdf'] = True
+            size = len(mm)
+            #Incremental updates (e.g. the metadata added by pdf2doi and pdf-renamer) are appended at the end of the file,
+            #so the tail of the file is scanned first
+            if size <= 2 * window:
+                ranges = [(0, size)]
+            else:
+                ranges = [(size - window, size), (0, window)]
+            low_confidence_hit = None
+            for source, pattern, confidence in identifier_patterns:
+                for start, end in ranges:
+                    for match in pattern.finditer(mm, start, end):
+                        identifier, identifier_type = extract_identifier(match.group(1))
+                        if not identifier:
+                            continue
+                        if confidence == 'high':
+                            result.update({'identifier': identifier, 'identifier_type': identifier_type, 'confidence': confidence, 'source': source})
+                            return result
+                        if low_confidence_hit is None:
+                            low_confidence_hit = {'identifier': identifier, 'identifier_type': identifier_type, 'confidence': confidence, 'source': source}
+                        break
+            if low_confidence_hit:
+                result.update(low_confidence_hit)
+    return result
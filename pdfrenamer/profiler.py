@@ -0,0 +1,241 @@
+'''
+This module implements the profiling mode of pdf-renamer (see the option --profile). The profiled code runs under cProfile and, at the same time,
+a background thread samples the call stack of the profiled thread every sampling_interval seconds. At the end of the run the following files are written
+    PREFIX.pstats   = the statistics collected by cProfile, which can be read with the module pstats (or with tools like snakeviz)
+    PREFIX.folded   = the sampled call stacks in the "collapsed" format (one line per stack, with the frames separated by ";" followed by the
+                      number of samples), which can be converted into a flame graph by flamegraph.pl, speedscope, inferno, etc.
+and a short report is printed, which splits the time between the functions of pdf-renamer which are called for each file (see own_functions),
+its dependencies (pdf2doi, pdf2bib, the pdf libraries), network and file I/O. The time spent in built-in functions which do not perform any
+I/O (e.g. regular expressions) is attributed to the component of the function which called them.
+Either the whole run is profiled (sample = 0), or only one file every sample files (see the function sample), to reduce the overhead on long runs.
+When a time or memory limit is set, the data of each file are extracted in a separate worker process (see the module workers.py), which is not
+profiled: the time spent waiting for the worker is reported as "other".
+'''
+
+import cProfile
+import os
+import pstats
+import sys
+import threading
+import time
+import logging
+from contextlib import contextmanager
+
+logger = logging.getLogger("pdf-renamer")
+
+sampling_interval = 0.005 #Time (in seconds) between two samples of the call stack
+
+#Functions of pdf-renamer which are listed individually in the report
+own_functions = ['sanitize', 'build_filename', 'find_abbreviation_journal', 'check_if_file_was_already_renamed_with_same_format']
+
+#Components used in the report. Each Python file is assigned to the first component whose list contains any of the folders in its path
+components = [('pdf-renamer', ['pdfrenamer']),
+              ('pdf2doi', ['pdf2doi']),
+              ('pdf2bib', ['pdf2bib']),
+              ('pdf libraries', ['pypdf', 'PyPDF2', 'fitz', 'pymupdf', 'pdfminer']),
+              ('network', ['requests', 'urllib3', 'http', 'feedparser', 'certifi', 'idna', 'charset_normalizer', 'chardet'])]
+network_modules = ['socket.py', 'ssl.py', 'selectors.py']
+#Substrings of the names that cProfile gives to the built-in functions which perform I/O
+network_builtins = ['_socket', '_ssl', 'select.']
+file_builtins = ['_io.', 'io.open', 'posix.', 'nt.', 'mmap', '_sqlite3']
+
+class StackSampler(threading.Thread):
+    '''
+    Background thread which samples the call stack of the thread thread_id, while self.active is set. The number of samples of each distinct
+    stack is stored in self.stacks.
+    '''
+    def __init__(self, thread_id):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.stacks = dict()
+        self.active = threading.Event()
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.is_set():
+            if not self.active.wait(0.1):
+                continue
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(frame_label(frame.f_code))
+                frame = frame.f_back
+            if stack:
+                stack = ';'.join(reversed(stack))
+                self.stacks[stack] = self.stacks.get(stack, 0) + 1
+            time.sleep(sampling_interval)
+
+    def stop(self):
+        self.stopped.set()
+
+def frame_label(code):
+    #The label of each frame contains the name of the function and its location (only the last two components of the path, for brevity)
+    path = code.co_filename.replace('\\', '/').split('/')
+    return f"{code.co_name} ({'/'.join(path[-2:])}:{code.co_firstlineno})".replace(';', ':')
+
+class Profiler():
+    '''
+    Collects the statistics of cProfile and the sampled call stacks of the current thread. The profiled code runs between the calls of
+    the methods enable and disable, which can be called several times (e.g. once for each sampled file).
+    '''
+    def __init__(self):
+        self.profile = cProfile.Profile()
+        self.sampler = StackSampler(threading.get_ident())
+        self.sampler.start()
+        self.files = 0
+        self.elapsed = 0
+
+    def enable(self):
+        self.started = time.perf_counter()
+        self.sampler.active.set()
+        self.profile.enable()
+
+    def disable(self):
+        self.profile.disable()
+        self.sampler.active.clear()
+        self.elapsed = self.elapsed + time.perf_counter() - self.started
+
+    def save(self, prefix):
+        '''
+        Writes the files prefix.pstats and prefix.folded. Returns the pstats.Stats object, or None if nothing was profiled.
+        '''
+        self.sampler.stop()
+        try:
+            stats = pstats.Stats(self.profile)
+        except TypeError: #Nothing was profiled
+            return None
+        stats.dump_stats(prefix + '.pstats')
+        with open(prefix + '.folded', 'w', encoding='utf-8') as f:
+            for stack, count in sorted(self.sampler.stacks.items()):
+                f.write(f"{stack} {count}\n")
+        return stats
+
+def component(func):
+    '''
+    Returns the component (see the list components) of the function func, i.e. a tuple (filename, line, name) as used by pstats. Returns None for
+    built-in functions which do not perform any I/O.
+    '''
+    filename, _, name = func
+    if filename == '~':
+        if any(s in name for s in network_builtins):
+            return 'network'
+        if any(s in name for s in file_builtins):
+            return 'file I/O'
+        return None
+    folders = filename.replace('\\', '/').split('/')
+    for label, packages in components:
+        if any(package in folders for package in packages):
+            return label
+    if folders[-1] in network_modules:
+        return 'network'
+    return 'other'
+
+def time_by_component(stats):
+    '''
+    Returns a dictionary with the time (in seconds) spent in each component. The time spent in built-in functions which do not perform I/O is
+    split among their callers.
+    '''
+    times = dict()
+    for func, (cc, nc, tt, ct, callers) in stats.stats.items():
+        label = component(func)
+        if label is not None:
+            times[label] = times.get(label, 0) + tt
+            continue
+        total_callers = sum(c[2] for c in callers.values())
+        if not total_callers:
+            times['other'] = times.get('other', 0) + tt
+            continue
+        for caller, c in callers.items():
+            caller_label = component(caller) or 'other'
+            times[caller_label] = times.get(caller_label, 0) + tt * c[2] / total_callers
+    return times
+
+def report(stats, files, elapsed):
+    '''
+    Returns a list of strings with a summary of the statistics stats, collected while processing files files (0 if the whole run was profiled)
+    in elapsed seconds.
+    '''
+    total = sum(tt for (cc, nc, tt, ct, callers) in stats.stats.values()) or 1e-9
+    lines = [f"Profiled time: {elapsed:.2f} s" + (f" ({files} file(s))" if files else "") + "."]
+    lines.append("Functions of pdf-renamer (calls, cumulative time):")
+    package_folder = os.path.dirname(os.path.abspath(__file__))
+    for name in own_functions:
+        calls, cumulative = 0, 0
+        for (filename, line, func_name), (cc, nc, tt, ct, callers) in stats.stats.items():
+            if func_name == name and os.path.dirname(os.path.abspath(filename)) == package_folder:
+                calls, cumulative = calls + nc, cumulative + ct
+        lines.append(f"    {name}: {calls} call(s), {cumulative:.3f} s ({100 * cumulative / total:.1f}%)")
+    lines.append("Time by component (own time of the functions, including the built-in functions they call):")
+    times = time_by_component(stats)
+    for label in [c[0] for c in components] + ['file I/O', 'other']:
+        if label in times:
+            lines.append(f"    {label}: {times[label]:.3f} s ({100 * times[label] / total:.1f}%)")
+    return lines
+
+_profiler = None
+_prefix = None
+_sample = 0
+_counter = 0
+
+def configure(prefix, sample=0):
+    '''
+    Activates the profiling mode. The output files are written with the path prefix (see the module docstring). If sample > 0, only one file
+    every sample files is profiled, otherwise the whole run is profiled.
+    '''
+    global _prefix, _sample
+    _prefix = prefix
+    _sample = sample
+
+@contextmanager
+def session():
+    '''
+    Context manager which encloses the whole run. When the profiling mode is active, the block is profiled (unless only a sample of files is
+    profiled, see the function sample), and the output files and the report are written at the end of the block.
+    '''
+    global _profiler
+    if not _prefix:
+        yield
+        return
+    _profiler = Profiler()
+    if not _sample:
+        _profiler.enable()
+    try:
+        yield
+    finally:
+        if not _sample:
+            _profiler.disable()
+        finish()
+
+@contextmanager
+def sample():
+    '''
+    Context manager which encloses the processing of a single file. If only a sample of files is profiled, the block is profiled once every _sample calls.
+    '''
+    global _counter
+    if not (_profiler and _sample):
+        yield
+        return
+    _counter = _counter + 1
+    if (_counter - 1) % _sample:
+        yield
+        return
+    _profiler.files = _profiler.files + 1
+    _profiler.enable()
+    try:
+        yield
+    finally:
+        _profiler.disable()
+
+def finish():
+    global _profiler
+    profiler, _profiler = _profiler, None
+    try:
+        stats = profiler.save(_prefix)
+    except OSError as e:
+        logger.error(f"It was not possible to write the profiling data into {_prefix}.pstats and {_prefix}.folded: {e}")
+        return
+    if stats is None:
+        logger.info("Nothing was profiled.")
+        return
+    print(f"Profiling data written into {_prefix}.pstats and {_prefix}.folded.")
+    print("\n".join(report(stats, profiler.files, profiler.elapsed)))
@@ -0,0 +1,139 @@
+'''
+This module defines the class RenameResult, which is used to store the outcome of the processing of a single pdf file.
+A RenameResult object behaves like the dictionaries which were originally returned by the function rename (i.e. result['path_new'],
+result.get('failure'), result.keys(), etc. all work as expected), but it uses __slots__ to store its fields and, unless explicitly
+requested, it does not keep the bulky fields returned by pdf2bib (raw validation info, bibtex string and full metadata).
+This keeps the memory usage low when a very large number of files is processed in a single run.
+'''
+
+import sys
+
+#The fields of the metadata dictionary which are used by the function build_filename. When the full metadata are not kept, only these fields are stored
+metadata_fields_for_filename = ('year', 'month', 'day', 'journal', 'ejournal', 'author', 'authors', 'title')
+
+#Fields which are not stored unless keep_metadata = True
+bulky_fields = ('validation_info', 'bibtex', 'path')
+
+class RenameResult():
+    '''
+    Outcome of the processing of a single pdf file. See the docstring of the function rename for the meaning of each field.
+    Keys which do not correspond to any of the predefined fields are stored in an auxiliary dictionary, created only when needed.
+    '''
+    __slots__ = ('path_original', 'path_new', 'identifier', 'identifier_type', 'validation_info', 'path', 'method',
+                 'metadata', 'bibtex', 'failure', 'error', 'duplicate_of', '_extra')
+
+    def __init__(self, **kwargs):
+        for key, value in kwargs.items():
+            self[key] = value
+
+    @classmethod
+    def from_dict(cls, data, keep_metadata=False):
+        '''
+        Creates a RenameResult object from the dictionary data (e.g. the one returned by pdf2bib). If keep_metadata = False,
+        the fields listed in bulky_fields are dropped (i.e. they are set to None, so that existing code accessing them as result['bibtex'],
+        result.get('bibtex') or 'bibtex' in result keeps working) and only the fields of data['metadata'] needed by build_filename are kept.
+        '''
+        if isinstance(data, RenameResult) and keep_metadata:
+            return data
+        result = cls()
+        if not keep_metadata:
+            for key in bulky_fields:
+                result[key] = None
+        for key, value in data.items():
+            if not keep_metadata:
+                if key in bulky_fields:
+                    continue
+                if key == 'metadata':
+                    value = compact_metadata(value)
+            if isinstance(value, str) and key in ('identifier_type', 'method', 'failure'):
+                value = sys.intern(value) #These fields can take only few possible values, so we store one copy of each
+            result[key] = value
+        return result
+
+    def __getitem__(self, key):
+        if key in RenameResult.__slots__ and key != '_extra':
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                raise KeyError(key) from None
+        try:
+            return self._extra[key]
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def __setitem__(self, key, value):
+        if key in RenameResult.__slots__ and key != '_extra':
+            setattr(self, key, value)
+            return
+        try:
+            self._extra[key] = value
+        except AttributeError:
+            self._extra = {key: value}
+
+    def __delitem__(self, key):
+        if key in RenameResult.__slots__ and key != '_extra':
+            try:
+                delattr(self, key)
+                return
+            except AttributeError:
+                raise KeyError(key) from None
+        try:
+            del self._extra[key]
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def __contains__(self, key):
+        try:
+            self[key]
+            return True
+        except KeyError:
+            return False
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self):
+        keys = [key for key in RenameResult.__slots__ if key != '_extra' and hasattr(self, key)]
+        if hasattr(self, '_extra'):
+            keys.extend(self._extra.keys())
+        return keys
+
+    def values(self):
+        return [self[key] for key in self.keys()]
+
+    def items(self):
+        return [(key, self[key]) for key in self.keys()]
+
+    def copy(self):
+        return self.__copy__()
+
+    def __copy__(self):
+        result = RenameResult()
+        for key, value in self.items():
+            result[key] = value
+        return result
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def __eq__(self, other):
+        if isinstance(other, (RenameResult, dict)):
+            return dict(self.items()) == dict(other.items())
+        return NotImplemented
+
+    def __repr__(self):
+        return 'RenameResult(' + ', '.join(f"{key}={value!r}" for key, value in self.items()) + ')'
+
+def compact_metadata(metadata):
+    '''
+    Returns a dictionary containing only the fields of the input dictionary metadata which are used by the function build_filename.
+    '''
+    if not metadata:
+        return metadata
+    return {key: metadata[key] for key in metadata_fields_for_filename if key in metadata}
@@ -0,0 +1,224 @@
+'''
+This module contains the functions used to keep track of the pdf files whose processing failed because of a transient problem
+(e.g. a network error, or a resolver which is temporarily down or is rate-limiting us). These files are stored in a persistent
+queue (the file retry_queue.json inside the pdf-renamer folder), together with the number of attempts done so far and the time
+after which the file can be attempted again. The waiting time grows exponentially with the number of attempts (with an additional
+random jitter, to avoid that many files are all retried at the same moment).
+The files in the queue can be processed again by calling pdf-renamer from command line with the option --retry-pending.
+pdf2doi catches the network errors raised while validating an identifier, and it simply rejects the identifier (the same happens when the resolver
+keeps answering with a 5xx status code, or when it answers with 429 Too Many Requests). To tell these files apart from files which really contain no
+valid identifier, the functions of pdf2doi which query the resolvers are wrapped, and the status code of each response received by pdf2doi is recorded
+(see the function monitor_connections). The number of failed connections is counted in the variable connection_failures.
+'''
+
+import json
+import os
+import random
+import socket
+import time
+import logging
+import functools
+import requests
+import pdf2doi
+import pdfrenamer.config as config
+import pdfrenamer.metrics as metrics
+
+logger = logging.getLogger("pdf-renamer")
+
+path_current_directory = os.path.dirname(__file__)
+path_retry_queue = os.path.join(path_current_directory, 'retry_queue.json')
+
+connection_failures = 0 #Number of times pdf2doi could not connect to a resolver, since the beginning of the run
+last_status = None #Status code of the last response received by pdf2doi
+
+def is_transient_status(status):
+    #Returns True if the HTTP status code status signals that the resolver is (temporarily) unable to serve us, and that the same request might succeed later
+    return status == 429 or (status is not None and status >= 500)
+
+class _RequestsRecorder():
+    #Replaces the module requests inside pdf2doi.finders. All attributes are taken from requests, but the status code of each response obtained
+    #via requests.get is stored in last_status
+    records_status = True
+
+    def __init__(self, module):
+        self.module = module
+
+    def __getattr__(self, name):
+        return getattr(self.module, name)
+
+    def get(self, *args, **kwargs):
+        global last_status
+        response = self.module.get(*args, **kwargs)
+        last_status = getattr(response, 'status_code', None)
+        return response
+
+def _count_connection_failures(function):
+    #Wraps a function of pdf2doi which returns -1 when it was not possible to connect to the resolver. If the last response had a transient status
+    #code (e.g. after all the attempts done by pdf2doi.finders.validate_doi_web failed with 503), -1 is returned as well
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        global connection_failures, last_status
+        last_status = None
+        output = function(*args, **kwargs)
+        if is_transient_status(last_status):
+            logger.info(f"The resolver answered with the status code {last_status}.")
+            output = -1
+        if isinstance(output, int) and output == -1:
+            connection_failures = connection_failures + 1
+        return output
+    wrapper.counts_connection_failures = True
+    return wrapper
+
+def monitor_connections():
+    '''
+    Wraps the functions used by pdf2doi to query dx.doi.org and export.arxiv.org, so that every failed connection (including responses with a transient
+    status code) increases connection_failures, and makes pdf2doi.validate return None (see the function _count_connection_failures).
+    It is called by the function rename in main.py (and by the worker processes, see workers.py), and it can be called more than once.
+    '''
+    if not getattr(pdf2doi.finders.requests, 'records_status', False):
+        pdf2doi.finders.requests = _RequestsRecorder(pdf2doi.finders.requests)
+    for name in ['validate_doi_web', 'validate_arxivID_web']:
+        function = getattr(pdf2doi.finders, name, None)
+        if function is not None and not getattr(function, 'counts_connection_failures', False):
+            setattr(pdf2doi.finders, name, _count_connection_failures(function))
+
+def classify_failure(exception=None, result=None, connection_failed=False):
+    '''
+    Decides whether the failure in processing a file is transient (i.e. it makes sense to try again later) or permanent.
+
+    Parameters
+    ----------
+    exception : Exception, optional
+        The exception raised while processing the file, if any.
+    result : dictionary, optional
+        The dictionary returned by pdf2bib for this file, if any.
+    connection_failed : boolean, optional
+        True if it was not possible to connect to a resolver, or if the resolver answered with a transient status code, while processing the file
+        (in which case pdf2doi rejects the identifiers it could not validate, and the file might look like it contains no identifier).
+
+    Returns
+    -------
+    string
+        Either 'transient' or 'permanent'
+    '''
+    if exception is not None:
+        if isinstance(exception, (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                                  ConnectionError, TimeoutError, socket.timeout, socket.gaierror)):
+            return 'transient'
+        return 'permanent'
+    if connection_failed:
+        return 'transient'
+    if result is not None:
+        #If an identifier was found but no bibtex data could be retrieved for it, the resolver was most likely unreachable.
+        #If no identifier was found at all, trying again will not help.
+        if result.get('identifier') and not result.get('metadata'):
+            return 'transient'
+    return 'permanent'
+
+def backoff_delay(attempts):
+    '''
+    Returns the number of seconds to wait before the next attempt, for a file which has already failed a number of times equal to attempts.
+    The delay is doubled at each attempt (starting from retry_base_delay and up to retry_max_delay), and a random jitter is applied by
+    picking the actual delay uniformly between half and the full value.
+    '''
+    delay = min(config.get('retry_max_delay'), config.get('retry_base_delay') * 2 ** max(attempts - 1, 0))
+    return random.uniform(delay / 2, delay)
+
+
+class RetryQueue():
+    '''
+    Persistent queue of files whose processing failed with a transient error. Each entry is indexed by the absolute path of the file and contains
+        entry['attempts']       = number of failed attempts so far
+        entry['next_attempt']   = time (in seconds since the epoch) after which the file can be processed again
+        entry['last_error']     = string describing the last error
+    '''
+
+    def __init__(self, path=path_retry_queue):
+        self.path = path
+        self.entries = dict()
+        self.load()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            self.entries = dict()
+            return
+        try:
+            with open(self.path, 'r') as f:
+                self.entries = json.load(f)
+        except Exception as e:
+            logger.error(f"The retry queue stored in {self.path} could not be loaded, and it will be reset: {e}")
+            self.entries = dict()
+
+    def save(self):
+        #We first write into a temporary file and then replace the old one, so that the queue is never left in a corrupted state
+        path_temp = self.path + '.tmp'
+        with open(path_temp, 'w') as f:
+            json.dump(self.entries, f, indent=1)
+        os.replace(path_temp, self.path)
+
+    def add(self, filename, error=''):
+        '''
+        Adds the file filename to the queue (or updates its entry if it is already there). Returns False if the file has already
+        reached the maximum number of attempts (in which case it is removed from the queue), and True otherwise.
+        '''
+        filename = os.path.abspath(filename)
+        entry = self.entries.get(filename, {'attempts': 0})
+        entry['attempts'] = entry['attempts'] + 1
+        if entry['attempts'] >= config.get('retry_max_attempts'):
+            self.entries.pop(filename, None)
+            return False
+        entry['next_attempt'] = time.time() + backoff_delay(entry['attempts'])
+        entry['last_error'] = str(error)
+        self.entries[filename] = entry
+        return True
+
+    def remove(self, filename):
+        self.entries.pop(os.path.abspath(filename), None)
+
+    def due(self, now=None):
+        '''
+        Returns the list of files in the queue whose waiting time has expired.
+        '''
+        if now is None:
+            now = time.time()
+        return [filename for filename, entry in self.entries.items() if entry['next_attempt'] <= now]
+
+    def next_due_time(self):
+        if not self.entries:
+            return None
+        return min(entry['next_attempt'] for entry in self.entries.values())
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, filename):
+        return os.path.abspath(filename) in self.entries
+
+def update_retry_queue(results, path=path_retry_queue):
+    '''
+    Given a list of results returned by the function rename, it adds to the persistent retry queue all files that failed with a transient error,
+    and it removes from the queue all the files which were processed successfully or which failed with a permanent error.
+    '''
+    queue = RetryQueue(path)
+    changed = False
+    for result in results:
+        if not result:
+            continue
+        if result.get('failure') == 'transient':
+            changed = True
+            if queue.add(result['path_original'], result.get('error', '')):
+                logger.info(f"The file {result['path_original']} was added to the retry queue.")
+            else:
+                logger.info(f"The file {result['path_original']} failed too many times, and it was removed from the retry queue.")
+                result['failure'] = 'permanent'
+        elif result['path_original'] in queue:
+            changed = True
+            queue.remove(result['path_original'])
+    metrics.retry_queue_files.set(len(queue))
+    if not changed:
+        return queue
+    try:
+        queue.save()
+    except Exception as e:
+        logger.error(f"Some error occured while saving the retry queue in {path}: {e}")
+    return queue
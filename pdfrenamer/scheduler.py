@@ -0,0 +1,197 @@
+'''
+This module decides the order in which the pdf files of a batch are processed. The order returned by os.listdir is arbitrary, and a few
+huge files (e.g. scanned books) can delay the processing of many small files. The order is decided by using only cheap signals, which
+are obtained without parsing the pdf files:
+    (1) the size of the file
+    (2) the number of pages, read from the /Count entry of the page tree
+    (3) whether a fast path applies to the file, i.e. whether the file was already renamed by pdf-renamer with the same format, or whether
+        its identifier is already known (because it is stored in the pdf metadata, or because the file name matches a filename pattern)
+To keep the cost of scheduling negligible, only the trailer at the end of each file is read, and the document info dictionary and the root of the
+page tree are then read directly at the offsets listed in the cross-reference table (i.e. a few small reads per file). When the cross-reference
+table is stored in a compressed stream, only the trailer is scanned for the fast-path markers, and the page tree is looked for at the beginning
+of the file (where most pdf writers store it). If it is not found there either, the number of pages is estimated from the size of the file.
+The policy is set by config.get('schedule'):
+    'none'  = the files are processed in the order in which they were found
+    'size'  = the files are processed from the smallest to the largest one
+    'cost'  = the files for which a fast path applies are processed first, and then all other files, from the least to the most expensive one.
+              When the files are added to the work queue (see the module work_queue.py) and taken by several workers, the files without a fast 
+              path are instead sorted from the most to the least expensive one, so that the expensive files are spread across workers and
+              the cheap files fill the gaps at the end of the run (see the argument largest_first of the function schedule)
+'''
+
+import os
+import re
+import logging
+import pdfrenamer.config as config
+import pdfrenamer.preflight as preflight
+import pdfrenamer.filename_patterns as filename_patterns
+
+logger = logging.getLogger("pdf-renamer")
+
+policies = ['none', 'size', 'cost']
+
+#Used to estimate the number of pages of files for which the page tree could not be found
+average_page_size = 64 * 1024
+
+trailer_window = 4 * 1024 #Number of bytes read at the end of the file, to find the trailer
+object_window = 16 * 1024 #Number of bytes read at the offset of each object (the /Kids array of the page tree can be long)
+max_xref_sections = 32 #Maximum number of cross-reference sections (i.e. of incremental updates) followed through the /Prev entries
+
+startxref_pattern = re.compile(rb'startxref\s+(\d+)')
+info_ref_pattern = re.compile(rb'/Info\s+(\d+)\s+\d+\s+R')
+root_ref_pattern = re.compile(rb'/Root\s+(\d+)\s+\d+\s+R')
+pages_ref_pattern = re.compile(rb'/Pages\s+(\d+)\s+\d+\s+R')
+prev_pattern = re.compile(rb'/Prev\s+(\d+)')
+count_pattern = re.compile(rb'/Count\s+(\d+)')
+page_tree_pattern = re.compile(rb'/Type\s*/Pages\b')
+nameformat_pattern = re.compile(rb'/pdfrenamer_nameformat\s*' + preflight._string, re.S)
+cached_identifier_pattern = re.compile(rb'/pdf2doi_identifier\s*' + preflight._string, re.S)
+
+def estimate_cost(filename, format=None):
+    '''
+    Collects the cheap signals used to schedule the file filename.
+
+    Parameters
+    ----------
+    filename : string
+        Path of the pdf file
+    format : string, optional
+        Filename format of the current run. If not specified, config.get('format') is used.
+
+    Returns
+    -------
+    info : dictionary
+        info['size']        = size of the file in bytes (0 if the file cannot be read)
+        info['pages']       = number of pages, or None if it could not be determined
+        info['fast_path']   = None if no fast path applies, otherwise either 'renamed' (the file was already renamed with the same format),
+                              'metadata' (the identifier is stored in the pdf metadata) or 'filename' (the file name matches a filename pattern)
+        info['cost']        = estimated cost of the file, in units of pages
+    '''
+    if format is None:
+        format = config.get('format')
+    info = {'size': 0, 'pages': None, 'fast_path': None, 'cost': 0}
+    try:
+        with open(filename, 'rb') as f:
+            info['size'] = os.fstat(f.fileno()).st_size
+            if info['size'] > 0:
+                scan_trailer(f, info['size'], format, info)
+    except (OSError, ValueError) as e:
+        logger.error(f"It was not possible to read the file {filename} to estimate its processing cost: {e}")
+
+    if info['fast_path'] is None and config.get('filename_patterns'):
+        if filename_patterns.find_identifiers_in_filename(filename, update_statistics=False):
+            info['fast_path'] = 'filename'
+
+    pages = info['pages'] if info['pages'] else max(1, info['size'] // average_page_size)
+    info['cost'] = 0 if info['fast_path'] == 'renamed' else pages
+    return info
+
+def scan_trailer(f, size, format, info):
+    #Reads the trailer of the file f, and then the document info dictionary and the root of the page tree, and stores the signals in the dictionary info
+    tail = read_at(f, max(0, size - trailer_window), trailer_window)
+    startxref = startxref_pattern.findall(tail)
+    trailer = tail[tail.rfind(b'trailer'):] if b'trailer' in tail else b''
+    xref_offset = int(startxref[-1]) if startxref else None
+    info_ref = info_ref_pattern.search(trailer)
+    info_object = read_object(f, xref_offset, int(info_ref.group(1))) if (info_ref and xref_offset is not None) else None
+    #If the info dictionary cannot be located, the markers are looked for in the trailer window, where incremental updates are appended
+    scan_fast_path(info_object if info_object is not None else tail, format, info)
+    root_ref = root_ref_pattern.search(trailer)
+    root = read_object(f, xref_offset, int(root_ref.group(1))) if (root_ref and xref_offset is not None) else None
+    pages_ref = pages_ref_pattern.search(root) if root else None
+    if pages_ref:
+        page_tree = read_object(f, xref_offset, int(pages_ref.group(1)))
+        count = count_pattern.search(page_tree) if page_tree else None
+        if count:
+            info['pages'] = int(count.group(1))
+    if info['pages'] is None:
+        #The root of the page tree is the /Pages object with the largest /Count (intermediate nodes of the tree only count their own pages)
+        head = read_at(f, 0, object_window)
+        for match in page_tree_pattern.finditer(head):
+            for count in count_pattern.findall(head[max(0, match.start() - 256):match.end() + 256]):
+                info['pages'] = max(info['pages'] or 0, int(count))
+
+def scan_fast_path(data, format, info):
+    #Looks for the fast-path markers inside the bytes data
+    #When pdf-renamer metadata were appended as incremental updates, the last value of /pdfrenamer_nameformat is the current one
+    values = [m.group(1) for m in nameformat_pattern.finditer(data)]
+    if values and preflight.decode_pdf_string(values[-1]).decode('utf-8', errors='ignore') == format:
+        info['fast_path'] = 'renamed'
+    elif cached_identifier_pattern.search(data):
+        info['fast_path'] = 'metadata'
+
+def read_at(f, offset, length):
+    f.seek(offset)
+    return f.read(length)
+
+def read_object(f, xref_offset, number):
+    '''
+    Returns the first bytes (up to object_window, and up to the keyword endobj) of the object number in the file f, by looking up its offset in
+    the cross-reference table which starts at xref_offset (and in the previous ones, following the /Prev entries). Returns None if the object
+    cannot be located, e.g. because the cross-reference table is stored in a compressed stream.
+    '''
+    offset = find_object_offset(f, xref_offset, number)
+    if offset is None:
+        return None
+    data = read_at(f, offset, object_window)
+    if not re.match(rb'\s*' + str(number).encode() + rb'\s+\d+\s+obj', data):
+        return None
+    end = data.find(b'endobj')
+    return data[:end] if end != -1 else data
+
+def find_object_offset(f, xref_offset, number):
+    #Returns the offset of the object number listed in the cross-reference table at xref_offset (or in the previous ones), or None
+    for _ in range(max_xref_sections):
+        if read_at(f, xref_offset, 4) != b'xref':
+            return None
+        f.readline(256)
+        while True:
+            subsection = f.readline(256).split()
+            if len(subsection) != 2 or not (subsection[0].isdigit() and subsection[1].isdigit()):
+                break
+            first, count = int(subsection[0]), int(subsection[1])
+            entries = f.tell()
+            if first <= number < first + count:
+                #Each entry of the table is exactly 20 bytes long, e.g. b'0000012345 00000 n \n'
+                entry = read_at(f, entries + 20 * (number - first), 20).split()
+                if len(entry) == 3 and entry[0].isdigit() and entry[2] == b'n':
+                    return int(entry[0])
+                return None
+            f.seek(entries + 20 * count)
+        prev = prev_pattern.search(f.read(object_window).split(b'startxref')[0])
+        if not prev:
+            return None
+        xref_offset = int(prev.group(1))
+    return None
+
+def schedule(pdf_files, policy=None, format=None, largest_first=False):
+    '''
+    Returns a new list containing the paths in the list pdf_files, sorted according to the policy policy (see the docstring of this module).
+    If policy is not specified, config.get('schedule') is used. The sorting is stable, i.e. files with the same cost keep their original order.
+    With the policy 'cost', the files without a fast path are sorted from the least to the most expensive one, unless largest_first = True
+    (used when the files are shared among several workers).
+    '''
+    if policy is None:
+        policy = config.get('schedule')
+    if policy not in policies:
+        logger.error(f"The scheduling policy \"{policy}\" is not valid. The files will be processed in the order in which they were found.")
+        policy = 'none'
+    if policy == 'none' or len(pdf_files) < 2:
+        return list(pdf_files)
+
+    if policy == 'size':
+        sizes = dict()
+        for f in pdf_files:
+            try:
+                sizes[f] = os.path.getsize(f)
+            except OSError:
+                sizes[f] = 0
+        return sorted(pdf_files, key=lambda f: sizes[f])
+
+    infos = {f: estimate_cost(f, format=format) for f in pdf_files}
+    fast = sorted([f for f in pdf_files if infos[f]['fast_path']], key=lambda f: (infos[f]['cost'], infos[f]['size']))
+    sign = -1 if largest_first else 1
+    slow = sorted([f for f in pdf_files if not infos[f]['fast_path']], key=lambda f: (sign * infos[f]['cost'], sign * infos[f]['size']))
+    logger.info(f"Scheduling {len(pdf_files)} file(s): a fast path applies to {len(fast)} of them, which will be processed first. " +
+                "The remaining files will be processed from the " + ("most to the least" if largest_first else "least to the most") + " expensive one.")
+    return fast + slow
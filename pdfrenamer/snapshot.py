@@ -0,0 +1,109 @@
+'''
+This module handles the metadata snapshot, i.e. a compact copy of the fields used by the function build_filename (year, month, day, journal,
+authors and title), which pdf-renamer stores in the pdf metadata (with the key /pdfrenamer_snapshot, as a JSON string) together with the
+filename format (/pdfrenamer_nameformat) whenever it renames a file.
+The snapshot allows to generate the name of the file with a different format without looking for its identifier and retrieving its data again
+(see the option --reformat, and the function reformat_files in main.py), i.e. with no network access and no text extraction. The snapshot is
+read from a bounded window of bytes at the beginning and at the end of the file, as done by the preflight check (see the module preflight.py),
+and the file is parsed by pypdf only if it is not found there (e.g. because the metadata are stored in a compressed object stream).
+'''
+
+import io
+import json
+import mmap
+import os
+import re
+import logging
+import pdf2doi
+import pdfrenamer.config as config
+import pdfrenamer.preflight as preflight
+from pdfrenamer.results import compact_metadata
+
+try:
+    from pypdf import PdfWriter
+except ImportError:
+    from PyPDF2 import PdfWriter
+
+logger = logging.getLogger("pdf-renamer")
+
+snapshot_key = '/pdfrenamer_snapshot'
+nameformat_key = '/pdfrenamer_nameformat'
+identifier_key = '/pdf2doi_identifier' #Same key used by pdf2doi
+snapshot_version = 1
+
+#Same as preflight._string, but allowing much longer strings (e.g. papers with hundreds of authors)
+snapshot_pattern = re.compile(rb'/pdfrenamer_snapshot\s*(\((?:[^()\\]|\\.){2,65536}\)|<[0-9a-fA-F\s]{4,262144}>)', re.S)
+
+def make_snapshot(metadata):
+    '''
+    Returns a compact JSON string containing the fields of the dictionary metadata used by build_filename. Authors are stored only with their
+    given and family names. Non-ascii characters are escaped, so that the snapshot is stored as a plain pdf string.
+    '''
+    snapshot = compact_metadata(metadata) or dict()
+    for key in ['author', 'authors']:
+        if isinstance(snapshot.get(key), list):
+            snapshot[key] = [{k: author[k] for k in ('given', 'family') if k in author} for author in snapshot[key] if isinstance(author, dict)]
+    snapshot = {key: value for key, value in snapshot.items() if value not in (None, '', [])}
+    snapshot['v'] = snapshot_version
+    return json.dumps(snapshot, separators=(',', ':'))
+
+def parse_snapshot(value):
+    '''
+    Converts the string value (as stored in the pdf metadata) into a dictionary which can be passed to build_filename. Returns None if value is not a valid snapshot.
+    '''
+    try:
+        snapshot = json.loads(value)
+    except (TypeError, ValueError):
+        return None
+    if not isinstance(snapshot, dict) or snapshot.pop('v', None) != snapshot_version:
+        return None
+    return snapshot
+
+def read_snapshot(filename, window=None):
+    '''
+    Returns the snapshot stored in the file filename (as a dictionary which can be passed to build_filename), or None if the file does not contain any.
+    If window is not specified, config.get('preflight_window') kilobytes are scanned at the beginning and at the end of the file.
+    '''
+    if window is None:
+        window = config.get('preflight_window') * 1024
+    with open(filename, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return None
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            ranges = [(0, size)] if size <= 2 * window else [(size - window, size), (0, window)]
+            for start, end in ranges:
+                #Metadata appended by incremental updates follow the older ones, so the last value is the current one
+                values = [m.group(1) for m in snapshot_pattern.finditer(mm, start, end)]
+                if values:
+                    return parse_snapshot(preflight.decode_pdf_string(values[-1]).decode('utf-8', errors='ignore'))
+            if size <= 2 * window and mm.find(snapshot_key.encode()) == -1:
+                return None
+        f.seek(0)
+        infos = pdf2doi.get_pdf_info(f)
+    if not infos or snapshot_key not in infos:
+        return None
+    return parse_snapshot(infos[snapshot_key])
+
+def add_metadata(filename, entries):
+    '''
+    Adds all the (key, value) pairs of the dictionary entries to the metadata of the pdf file filename, rewriting the file only once.
+    Returns True if the metadata were added succesfully, False otherwise.
+    '''
+    try:
+        writer = PdfWriter(clone_from=filename)
+        writer.add_metadata(entries)
+        buffer = io.BytesIO()
+        writer.write(buffer)
+    except Exception as e:
+        logger.error(f"An error occured while trying to add the metadata {', '.join(entries)} to the file {filename}: {e}")
+        return False
+    #The file is written in place (and not replaced), so that hard links to the file are preserved
+    try:
+        with open(filename, 'wb') as f:
+            f.write(buffer.getvalue())
+    except OSError as e:
+        logger.error(f"An error occured while writing the file {filename}. Maybe the file is open elsewhere? {e}")
+        return False
+    logger.info(f"The metadata {', '.join(entries)} were added to the file {filename}.")
+    return True
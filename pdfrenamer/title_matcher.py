@@ -0,0 +1,154 @@
+'''
+This module is used for pdf files for which no identifier (DOI or arXiv ID) could be found, e.g. scanned legacy papers. Several candidate
+titles are extracted from the file (the titles found by pdf2doi, and the first lines of text of the first page, alone or joined in groups
+of two or three lines, since titles often span several lines), and they are compared with the titles of the entries of the local
+bibliographies (see the module bib_index.py). Everything runs offline.
+For each candidate, only the entries which share the largest number of (rare) words with it are retrieved from the inverted index of
+each bibliography, so the time needed does not grow with the size of the bibliographies. The retrieved titles are then compared with the
+candidate, and each pair gets a similarity score between 0 and 1, equal to the average of the similarity of the two strings (computed by
+difflib.SequenceMatcher, which tolerates small OCR errors) and the fraction of words they have in common (which penalizes titles differing by
+whole words, such as "...mechanical oscillators" and "...mechanical resonators").
+    - If the best score is at least config.get('title_match_threshold') (in percent), the entry is accepted and its data are used to rename the file,
+      unless a different entry has almost the same score (in which case the match is considered ambiguous)
+    - If the best score is at least config.get('title_match_borderline'), the match is reported (with its score) but not used
+'''
+
+import difflib
+import logging
+import pdf2doi
+import pdf2bib
+import pdfrenamer.config as config
+import pdfrenamer.bib_index as bib_index
+import pdfrenamer.workers as workers
+
+try:
+    from pypdf import PdfReader
+except ImportError:
+    from PyPDF2 import PdfReader
+
+logger = logging.getLogger("pdf-renamer")
+
+max_lines = 12 #Number of lines at the top of the first page which are used as candidate titles
+min_title_length = 12 #Candidates shorter than this (after normalization) are ignored
+ambiguity_margin = 0.02 #Two matches whose scores differ by less than this are considered equally good
+
+def candidate_titles(filename):
+    '''
+    Returns a list of strings extracted from the file filename which might contain the title of the paper.
+    '''
+    candidates = []
+    with open(filename, 'rb') as f:
+        try:
+            candidates.extend(pdf2doi.finders.find_possible_titles(f))
+        except Exception as e:
+            logger.error(f"Some error occured while looking for the title of this file: {e}")
+        try:
+            f.seek(0)
+            text = PdfReader(f, strict=False).pages[0].extract_text() or ''
+        except Exception as e:
+            logger.error(f"Some error occured while reading the text of the first page of this file: {e}")
+            text = ''
+    lines = [line.strip() for line in text.splitlines() if len(line.split()) >= 2][:max_lines]
+    for n in (1, 2, 3):
+        candidates.extend(' '.join(lines[i:i+n]) for i in range(len(lines) - n + 1))
+    unique = []
+    for candidate in candidates:
+        if len(bib_index.normalize_title(candidate)) >= min_title_length and candidate not in unique:
+            unique.append(candidate)
+    return unique
+
+def similarity(a, b):
+    '''
+    Returns a similarity score between 0 and 1 of the (already normalized) titles a and b.
+    '''
+    words_a, words_b = set(a.split()), set(b.split())
+    if not (words_a and words_b):
+        return 0
+    return (difflib.SequenceMatcher(None, a, b, autojunk=False).ratio() + len(words_a & words_b) / len(words_a | words_b)) / 2
+
+def match_candidates(candidates):
+    '''
+    Compares the strings in the list candidates with the titles of the entries of all local bibliographies. Returns a list of dictionaries, one
+    for each paper which was retrieved for any candidate, sorted from the highest to the lowest score. Each dictionary has the keys
+        'score'     = similarity score between 0 and 1 (the highest one among all candidates)
+        'candidate' = the candidate which obtained the highest score
+        'title'     = normalized title of the entry
+        'doi', 'arxiv', 'metadata'  = data of the entry
+        'source'    = path of the bibliography containing the entry
+    The same paper is often contained in several bibliographies: entries which share the DOI or the arXiv ID (or, if they do not have conflicting
+    identifiers, the normalized title) are merged into a single match (see the function same_paper), so that they are not considered ambiguous.
+    '''
+    matches = dict()
+    for index in bib_index._indexes:
+        for candidate in candidates:
+            normalized = bib_index.normalize_title(candidate)
+            for entry in index.search_title(normalized):
+                score = similarity(normalized, entry['title'])
+                key = (index.source, entry['title'], entry['doi'], entry['arxiv'])
+                if key not in matches or score > matches[key]['score']:
+                    matches[key] = {'score': score, 'candidate': candidate, 'title': entry['title'], 'doi': entry['doi'], 'arxiv': entry['arxiv'],
+                                    'metadata': entry['metadata'], 'source': index.source}
+    merged = []
+    #Matches with the same score keep the order of the bibliographies, so the data of the first bibliography containing the paper are used
+    for match in sorted(matches.values(), key=lambda m: -m['score']):
+        for other in merged:
+            if same_paper(match, other):
+                #The identifiers missing from the entry with the highest score are taken from the other entries
+                other['doi'] = other['doi'] or match['doi']
+                other['arxiv'] = other['arxiv'] or match['arxiv']
+                break
+        else:
+            merged.append(match)
+    return merged
+
+def same_paper(a, b):
+    '''
+    Returns True if the matches a and b (see match_candidates) refer to the same paper, i.e. if they share the DOI or the arXiv ID, or if they have the
+    same normalized title and no conflicting identifiers.
+    '''
+    if (a['doi'] and a['doi'] == b['doi']) or (a['arxiv'] and a['arxiv'] == b['arxiv']):
+        return True
+    if (a['doi'] and b['doi']) or (a['arxiv'] and b['arxiv']):
+        return False
+    return a['title'] == b['title']
+
+def match_file(filename):
+    '''
+    Looks for the entry of the local bibliographies whose title best matches the text of the file filename. It raises workers.ExtractionFailed if the
+    extraction of the candidate titles exceeds the time or memory limits.
+
+    Returns
+    -------
+    match : dictionary or None
+        None if no match was found with a score at least equal to config.get('title_match_borderline'). Otherwise a dictionary with the same
+        keys described in match_candidates, and the additional key 'accepted', which is True if the match can be used to rename the file.
+    '''
+    if not bib_index.is_active():
+        return None
+    #The titles are extracted within the same time and memory limits used for the extraction of the identifier (see the module workers.py)
+    matches = match_candidates(workers.extract_titles(filename))
+    if not matches or matches[0]['score'] * 100 < config.get('title_match_borderline'):
+        return None
+    best = matches[0]
+    best['accepted'] = best['score'] * 100 >= config.get('title_match_threshold')
+    if best['accepted'] and len(matches) > 1 and best['score'] - matches[1]['score'] < ambiguity_margin:
+        logger.info(f"The title of this file matches two different entries of the local bibliographies with almost the same score ({best['score']:.2f} and " +
+                    f"{matches[1]['score']:.2f}), so the match will not be used.")
+        best['accepted'] = False
+    return best
+
+def apply_match(result, match):
+    '''
+    Stores the data of the entry match (returned by match_file) in the dictionary result, in the same format used by pdf2bib. If the entry has no DOI
+    or arXiv ID, its normalized title is used as identifier.
+    '''
+    if match['doi']:
+        result['identifier'], result['identifier_type'] = match['doi'], 'DOI'
+    elif match['arxiv']:
+        result['identifier'], result['identifier_type'] = match['arxiv'], 'arxiv ID'
+    else:
+        result['identifier'], result['identifier_type'] = bib_index.normalize_title(match['metadata']['title']), 'title'
+    result['method'] = f"title match (score {match['score']:.2f})"
+    result['metadata'] = match['metadata']
+    result['bibtex'] = pdf2bib.make_bibtex(match['metadata'])
+    result['metadata_source'] = match['source']
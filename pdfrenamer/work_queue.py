@@ -0,0 +1,304 @@
+'''
+This module implements a durable work queue, which allows several pdf-renamer processes (on the same machine, or on several machines which
+share the same storage) to process the same tree of pdf files. The queue is a SQLite database, typically stored on the shared volume.
+    (1) "pdfrenamer --enqueue TREE" adds all pdf files in TREE to the queue, in the order decided by the scheduling policy (see the module scheduler.py).
+        Files already present in the queue are not added again, so the same command can be used to add new files to an existing queue.
+    (2) "pdfrenamer --worker QUEUE" starts a worker, which repeatedly leases a file from the queue, processes it and acknowledges it (i.e. it
+        stores the outcome in the queue). Any number of workers can be started.
+Each lease expires after config.get('queue_lease_time') seconds. While a worker is processing a file, a background thread renews the lease
+(heartbeat), so that only the leases of workers which crashed or got disconnected expire, and their files are given to other workers.
+Files which failed with a transient error are put back in the queue, and they are leased again after an exponential backoff (see the module
+retry_queue.py). A file whose processing was attempted config.get('retry_max_attempts') times is marked as failed.
+The paths of the files are stored relative to the folder which contains the database, so that workers which mount the shared volume at
+different paths (or on different operating systems) can use the same queue.
+All changes to the queue are done inside "BEGIN IMMEDIATE" transactions, which take the database write lock before reading, so that two workers
+can never lease the same file. The default rollback journal is used (and not WAL), because WAL does not work on network file systems.
+'''
+
+import os
+import socket
+import sqlite3
+import threading
+import time
+import logging
+import pdfrenamer.config as config
+import pdfrenamer.retry_queue as retry_queue
+import pdfrenamer.metrics as metrics
+
+logger = logging.getLogger("pdf-renamer")
+
+#Time (in seconds) a worker waits before asking again for a file, when all remaining files are leased by other workers or waiting for a retry
+poll_interval = 5
+
+#Time (in seconds) a connection waits for the database lock held by another process before giving up
+lock_timeout = 60
+
+schema = '''
+CREATE TABLE IF NOT EXISTS files (
+    path            TEXT PRIMARY KEY,
+    priority        INTEGER NOT NULL,
+    state           TEXT NOT NULL DEFAULT 'pending',
+    owner           TEXT,
+    lease_expires   REAL,
+    not_before      REAL NOT NULL DEFAULT 0,
+    attempts        INTEGER NOT NULL DEFAULT 0,
+    failure         TEXT,
+    error           TEXT,
+    path_new        TEXT
+);
+CREATE INDEX IF NOT EXISTS files_state_priority ON files (state, priority);
+CREATE INDEX IF NOT EXISTS files_path_new ON files (path_new);
+'''
+
+#Possible values of the column state
+states = ['pending', 'leased', 'done', 'failed']
+
+class WorkQueue():
+    '''
+    Durable queue of pdf files, stored in the SQLite database specified by path. Each row of the table files contains
+        path            = path of the pdf file, relative to the folder which contains the database (see the methods relative and resolve)
+        priority        = files with a lower value are leased first
+        state           = one of 'pending', 'leased', 'done' or 'failed'
+        owner           = identifier of the worker which holds (or last held) the lease
+        lease_expires   = time (in seconds since the epoch) at which the lease expires, unless it is renewed
+        not_before      = time (in seconds since the epoch) before which the file cannot be leased (used to retry files with a backoff)
+        attempts        = number of times the file was leased
+        failure, error  = outcome of the last attempt (see the function rename in main.py)
+        path_new        = new path of the file (relative to the same folder), if it was renamed
+    The methods of this class take and return paths which are valid on the current machine (i.e. absolute paths, or paths relative to the current folder).
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.base = os.path.dirname(os.path.abspath(path))
+        self.connection = sqlite3.connect(path, timeout=lock_timeout, isolation_level=None)
+        self.connection.executescript(schema)
+
+    def close(self):
+        self.connection.close()
+
+    def transaction(self):
+        return _Transaction(self.connection)
+
+    def relative(self, path):
+        '''
+        Converts path into the form stored in the database, i.e. relative to the folder of the database and with '/' as separator. The path is kept
+        absolute if it cannot be expressed relative to that folder (e.g. because it is on a different drive).
+        '''
+        if path is None:
+            return None
+        try:
+            return os.path.relpath(os.path.abspath(path), self.base).replace(os.sep, '/')
+        except ValueError:
+            return os.path.abspath(path)
+
+    def resolve(self, path):
+        '''
+        Converts a path stored in the database into a path valid on this machine. Absolute paths (e.g. stored by older versions) are returned unchanged.
+        '''
+        if path is None:
+            return None
+        return os.path.normpath(os.path.join(self.base, path))
+
+    def enqueue(self, paths):
+        '''
+        Adds the files in the list paths to the queue, with priorities following the order of the list (after any file already in the queue).
+        Files already present in the queue, and files which were created by a worker when renaming a file of the queue, are ignored.
+        Returns the number of files added.
+        '''
+        with self.transaction() as cursor:
+            start = cursor.execute("SELECT COALESCE(MAX(priority), -1) + 1 FROM files").fetchone()[0]
+            before = cursor.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+            cursor.executemany("INSERT OR IGNORE INTO files (path, priority) SELECT ?, ? WHERE NOT EXISTS (SELECT 1 FROM files WHERE path_new = ?)",
+                               ((self.relative(p), start + i, self.relative(p)) for i, p in enumerate(paths)))
+            after = cursor.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+        return after - before
+
+    def lease(self, owner, lease_time=None):
+        '''
+        Leases the pending file with the lowest priority value to the worker owner, for lease_time seconds (if not specified, config.get('queue_lease_time')
+        is used). Files whose lease has expired are considered pending again. Returns the path of the file, or None if no file can be leased right now.
+        '''
+        if lease_time is None:
+            lease_time = config.get('queue_lease_time')
+        now = time.time()
+        with self.transaction() as cursor:
+            self._expire_leases(cursor, now)
+            row = cursor.execute("SELECT path FROM files WHERE state = 'pending' AND not_before <= ? ORDER BY priority LIMIT 1", (now,)).fetchone()
+            if row is None:
+                return None
+            cursor.execute("UPDATE files SET state = 'leased', owner = ?, lease_expires = ?, attempts = attempts + 1 WHERE path = ?",
+                           (owner, now + lease_time, row[0]))
+        return self.resolve(row[0])
+
+    def _expire_leases(self, cursor, now):
+        #Files whose lease has expired (because their worker crashed or got disconnected) are made available again, unless they have been
+        #already attempted too many times, e.g. because the file makes the worker crash
+        cursor.execute("UPDATE files SET state = 'failed', failure = 'permanent', error = 'The lease expired too many times' " +
+                       "WHERE state = 'leased' AND lease_expires < ? AND attempts >= ?", (now, config.get('retry_max_attempts')))
+        cursor.execute("UPDATE files SET state = 'pending' WHERE state = 'leased' AND lease_expires < ?", (now,))
+
+    def heartbeat(self, owner, path, lease_time=None):
+        '''
+        Renews the lease of the worker owner on the file path. Returns False if the worker does not hold the lease anymore (e.g. because it expired).
+        '''
+        if lease_time is None:
+            lease_time = config.get('queue_lease_time')
+        with self.transaction() as cursor:
+            cursor.execute("UPDATE files SET lease_expires = ? WHERE path = ? AND owner = ? AND state = 'leased'", (time.time() + lease_time, self.relative(path), owner))
+            return cursor.rowcount > 0
+
+    def ack(self, owner, path, result):
+        '''
+        Stores the outcome of the processing of the file path, contained in the dictionary (or RenameResult object) result. Files which failed with
+        a transient error are put back in the queue with a backoff, unless they have been already attempted config.get('retry_max_attempts') times.
+        Returns False if the worker owner does not hold the lease on the file anymore (in this case the outcome is not stored, since the file
+        has been given to another worker).
+        '''
+        failure = result.get('failure')
+        path = self.relative(path)
+        with self.transaction() as cursor:
+            row = cursor.execute("SELECT attempts FROM files WHERE path = ? AND owner = ? AND state = 'leased'", (path, owner)).fetchone()
+            if row is None:
+                return False
+            if failure == 'transient' and row[0] < config.get('retry_max_attempts'):
+                state, not_before = 'pending', time.time() + retry_queue.backoff_delay(row[0])
+            else:
+                state, not_before = ('done' if not failure else 'failed'), 0
+            cursor.execute("UPDATE files SET state = ?, not_before = ?, lease_expires = NULL, failure = ?, error = ?, path_new = ? WHERE path = ?",
+                           (state, not_before, failure, result.get('error'), self.relative(result.get('path_new')), path))
+        return True
+
+    def counts(self):
+        '''
+        Returns a dictionary with the number of files in each state.
+        '''
+        counts = {state: 0 for state in states}
+        for state, count in self.connection.execute("SELECT state, COUNT(*) FROM files GROUP BY state"):
+            counts[state] = count
+        return counts
+
+    def next_lease_time(self):
+        '''
+        Returns the earliest time at which a file which is not done or failed might become available (either because it is waiting for a retry,
+        or because its lease expires), or None if all files are done or failed.
+        '''
+        row = self.connection.execute("SELECT MIN(CASE WHEN state = 'pending' THEN not_before ELSE lease_expires END) FROM files " +
+                                      "WHERE state IN ('pending', 'leased')").fetchone()
+        return row[0]
+
+class _Transaction():
+    #Context manager which runs a block of statements inside a "BEGIN IMMEDIATE" transaction, and commits it (or rolls it back, in case of errors)
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        self.cursor = self.connection.cursor()
+        self.cursor.execute("BEGIN IMMEDIATE")
+        return self.cursor
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if exc_type is None:
+            self.cursor.execute("COMMIT")
+        else:
+            self.cursor.execute("ROLLBACK")
+        self.cursor.close()
+        return False
+
+class Heartbeat(threading.Thread):
+    '''
+    Background thread which periodically renews the lease of a worker on the file it is currently processing. It uses its own connection to the
+    database, since SQLite connections cannot be shared between threads.
+    '''
+    def __init__(self, path_queue, owner):
+        super().__init__(daemon=True)
+        self.path_queue = path_queue
+        self.owner = owner
+        self.current = None
+        self.stopped = threading.Event()
+        self.lock = threading.Lock()
+
+    def set_current(self, path):
+        with self.lock:
+            self.current = path
+
+    def run(self):
+        queue = WorkQueue(self.path_queue)
+        try:
+            while not self.stopped.wait(max(config.get('queue_lease_time') / 3, 1)):
+                with self.lock:
+                    path = self.current
+                if path is None:
+                    continue
+                try:
+                    queue.heartbeat(self.owner, path)
+                except sqlite3.Error as e:
+                    logger.error(f"It was not possible to renew the lease on the file {path}: {e}")
+        finally:
+            queue.close()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+def worker_id():
+    '''
+    Returns a string which identifies this worker process among all workers using the same queue (possibly on different machines).
+    '''
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+def run_worker(path_queue, process_file):
+    '''
+    Leases files from the queue stored in path_queue and processes them, until all files in the queue are either done or failed.
+
+    Parameters
+    ----------
+    path_queue : string
+        Path of the SQLite database containing the queue
+    process_file : function
+        Function which is called with the path of each leased file, and which returns a dictionary (or a RenameResult object) with at least
+        the keys 'failure', 'error' and 'path_new' (e.g. the function rename in main.py).
+
+    Returns
+    -------
+    counts : dictionary
+        Number of files processed by this worker, for each outcome (None for successful files, or the value of result['failure'])
+    '''
+    owner = worker_id()
+    queue = WorkQueue(path_queue)
+    heartbeat = Heartbeat(path_queue, owner)
+    heartbeat.start()
+    counts = dict()
+    logger.info(f"Worker {owner} started on the queue {path_queue}.")
+    try:
+        while True:
+            path = queue.lease(owner)
+            if path is None:
+                next_time = queue.next_lease_time()
+                if next_time is None:
+                    logger.info("All files in the queue have been processed.")
+                    break
+                time.sleep(min(max(next_time - time.time(), 0.1), poll_interval))
+                continue
+            heartbeat.set_current(path)
+            if not os.path.exists(path):
+                logger.error(f"The file {path} does not exist anymore.")
+                result = {'failure': 'permanent', 'error': 'File not found', 'path_new': None}
+            else:
+                try:
+                    result = process_file(path)
+                except Exception as e:
+                    logger.error(f"Some unexpected error occured while processing the file {path}: {e}")
+                    result = {'failure': retry_queue.classify_failure(exception=e), 'error': str(e), 'path_new': None}
+                if result is None:
+                    result = {'failure': 'permanent', 'error': 'The file could not be processed', 'path_new': None}
+            heartbeat.set_current(None)
+            if not queue.ack(owner, path, result):
+                logger.error(f"The lease on the file {path} expired before its processing was completed, and the file was given to another worker.")
+            counts[result.get('failure')] = counts.get(result.get('failure'), 0) + 1
+            for state, count in queue.counts().items():
+                metrics.queue_files.set(count, state=state)
+    finally:
+        heartbeat.stop()
+        queue.close()
+    return counts
@@ -0,0 +1,252 @@
+'''
+This module allows to run the extraction of the bibtex data of a pdf file (i.e. the call to pdf2bib.pdf2bib_singlefile, which in turn calls
+pdf2doi) inside a separate worker process, so that a per-file limit on the wall-clock time (config.get('file_timeout'), in seconds) and on the
+resident memory (config.get('file_max_mem'), in megabytes) can be enforced. When a file exceeds any of the two limits, the worker process is
+killed and a new one is started for the next file, so that a single malformed or huge pdf file cannot stall the whole run.
+To contain possible memory leaks in the pdf libraries, each worker is also replaced by a new one after it has processed
+config.get('worker_max_files') files.
+The candidate titles used to match a file against the local bibliographies (see the function extract_titles, and the module title_matcher.py)
+are extracted in the same worker process, since they also require parsing the pdf file.
+If both limits are set to 0 (default), the extraction runs in the main process, as usual.
+The extraction can also run without querying any online resolver (see the argument online of the function extract), which is used to look for the
+identifier in the local bibliographies first (see the module bib_index.py).
+'''
+
+import atexit
+import logging
+import multiprocessing
+import os
+import time
+import pdf2bib
+import pdf2doi
+import pdfrenamer.config as config
+import pdfrenamer.retry_queue as retry_queue
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+logger = logging.getLogger("pdf-renamer")
+
+poll_interval = 0.1 #Interval (in seconds) between two consecutive checks of the memory used by a worker
+
+class ExtractionFailed(Exception):
+    '''
+    Raised when the extraction of the data of a file inside a worker process fails. The attribute failure is either 'timeout', 'oom' (i.e. the
+    memory limit was exceeded), 'transient' or 'permanent' (see the module retry_queue.py).
+    '''
+    def __init__(self, message, failure):
+        super().__init__(message)
+        self.failure = failure
+
+def get_rss(pid):
+    '''
+    Returns the resident memory (in bytes) used by the process with the specified pid, or None if it cannot be determined.
+    The library psutil is used if installed; otherwise the information is read from /proc (which only works on Linux).
+    '''
+    if psutil is not None:
+        try:
+            return psutil.Process(pid).memory_info().rss
+        except psutil.Error:
+            return None
+    try:
+        with open(f'/proc/{pid}/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+def run_pdf2bib(filename, online=True):
+    #Calls pdf2bib.pdf2bib_singlefile. If online = False, pdf2doi does not validate the identifiers online and does not search the web,
+    #i.e. it returns the first identifier found in the file (with validation_info = True), and pdf2bib returns no bibtex data
+    if online:
+        return pdf2bib.pdf2bib_singlefile(filename)
+    settings = {key: pdf2doi.config.get(key) for key in ['webvalidation', 'websearch']}
+    for key in settings:
+        pdf2doi.config.set(key, False)
+    try:
+        return pdf2bib.pdf2bib_singlefile(filename)
+    finally:
+        for key, value in settings.items():
+            pdf2doi.config.set(key, value)
+
+def _pdf2bib_task(filename, online):
+    #Task 'pdf2bib' of the worker process
+    connection_failures = retry_queue.connection_failures
+    result = run_pdf2bib(filename, online)
+    #The failed connections are reported to the main process, which adds them to its own counter (see the function extract)
+    result['connection_failures'] = retry_queue.connection_failures - connection_failures
+    if isinstance(result.get('validation_info'), dict):
+        result['validation_info'] = dict(result['validation_info']) #Make sure that the result can be pickled
+    return result
+
+def _titles_task(filename):
+    #Task 'titles' of the worker process. The module title_matcher.py is imported here, since it imports this module
+    import pdfrenamer.title_matcher as title_matcher
+    return title_matcher.candidate_titles(filename)
+
+tasks = {'pdf2bib': _pdf2bib_task, 'titles': _titles_task}
+
+def _worker_main(connection, settings):
+    #Entry point of the worker process. It receives the tasks through connection, as tuples (name, filename, *args) where name is a key of the 
+    #dictionary tasks, and it sends back either ('ok', result) or ('error', message, failure). A None received through connection means that
+    #the worker must terminate.
+    config.set('verbose', settings['verbose'])
+    pdf2doi.config.set('save_identifier_metadata', settings['save_identifier_metadata'])
+    pdf2bib.config.set('save_identifier_metadata', settings['save_identifier_metadata'])
+    retry_queue.monitor_connections()
+    while True:
+        try:
+            task = connection.recv()
+        except EOFError:
+            return
+        if task is None:
+            return
+        try:
+            result = tasks[task[0]](*task[1:])
+            connection.send(('ok', result))
+        except MemoryError as e:
+            connection.send(('error', 'The memory limit was exceeded: ' + str(e), 'oom'))
+        except Exception as e:
+            connection.send(('error', str(e), retry_queue.classify_failure(exception=e)))
+
+class ExtractionWorker():
+    '''
+    A worker process which extracts the data of one pdf file at a time. The process is started lazily, and it is restarted whenever it
+    is killed (because a file exceeded the time or memory limit) or after it has processed config.get('worker_max_files') files.
+    '''
+    def __init__(self):
+        self.process = None
+        self.connection = None
+        self.numb_files = 0
+        self.busy_with = None
+
+    def start(self):
+        parent_connection, child_connection = multiprocessing.Pipe()
+        #The worker never writes into the pdf files (the identifier found by pdf2doi is stored by the main process, see the function 
+        #apply_new_filename in main.py), so that killing the worker cannot leave a file partially written
+        settings = {'verbose': config.get('verbose'), 'save_identifier_metadata': False}
+        self.process = multiprocessing.Process(target=_worker_main, args=(child_connection, settings), daemon=True)
+        self.process.start()
+        child_connection.close()
+        self.connection = parent_connection
+        self.numb_files = 0
+
+    def stop(self, kill=False):
+        if self.process is None:
+            return
+        if not kill:
+            try:
+                self.connection.send(None)
+                self.process.join(timeout=5)
+            except (OSError, EOFError):
+                pass
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.connection.close()
+        self.process = None
+        self.connection = None
+        self.busy_with = None
+
+    def is_alive(self):
+        return self.process is not None and self.process.is_alive()
+
+    def submit(self, task, filename, *args):
+        '''
+        Sends the task task (a key of the dictionary tasks) for the file filename to the worker process (starting the process, if needed). 
+        The result is collected by the method check.
+        '''
+        if self.process is not None and (not self.is_alive() or self.numb_files >= config.get('worker_max_files') > 0):
+            self.stop()
+        if self.process is None:
+            self.start()
+        self.connection.send((task, filename) + args)
+        self.numb_files = self.numb_files + 1
+        self.busy_with = filename
+        self.started_at = time.monotonic()
+
+    def check(self):
+        '''
+        Checks the status of the file currently processed by the worker. It returns None if the worker is still working on it,
+        and otherwise either ('ok', result) or ('error', message, failure). If the file exceeded the time or memory limit, the
+        worker process is killed.
+        '''
+        timeout = config.get('file_timeout')
+        max_mem = config.get('file_max_mem')
+        try:
+            if self.connection.poll():
+                message = self.connection.recv()
+                self.busy_with = None
+                return message
+        except (EOFError, OSError):
+            pass
+        if not self.is_alive():
+            #The process died without sending a result. The most common reason is that the operating system killed it because it ran out of memory
+            self.stop(kill=True)
+            return ('error', 'The worker process terminated unexpectedly (probably because it ran out of memory).', 'oom')
+        if timeout and time.monotonic() - self.started_at > timeout:
+            self.stop(kill=True)
+            return ('error', f"The processing of this file took more than {timeout} seconds.", 'timeout')
+        if max_mem:
+            rss = get_rss(self.process.pid)
+            if rss is not None and rss > max_mem * 1024 * 1024:
+                self.stop(kill=True)
+                return ('error', f"The processing of this file used more than {max_mem} MB of memory.", 'oom')
+        return None
+
+    def run(self, task, filename, *args):
+        '''
+        Runs the task task (a key of the dictionary tasks) for the file filename inside the worker process, and waits for the result. 
+        Returns the output of the task (e.g. the same dictionary returned by pdf2bib.pdf2bib_singlefile for the task 'pdf2bib'), or raises ExtractionFailed.
+        '''
+        self.submit(task, filename, *args)
+        while True:
+            message = self.check()
+            if message is not None:
+                break
+            self.connection.poll(poll_interval)
+        if message[0] == 'ok':
+            return message[1]
+        raise ExtractionFailed(message[1], message[2])
+
+def limits_enabled():
+    return bool(config.get('file_timeout')) or bool(config.get('file_max_mem'))
+
+_worker = None
+
+def extract(filename, online=True):
+    '''
+    Extracts the bibtex data of the file filename by calling pdf2bib.pdf2bib_singlefile. If a time or memory limit is set, the extraction runs inside
+    a worker process (see the class ExtractionWorker), and ExtractionFailed is raised if the file exceeds any of the limits.
+    If online = False, no resolver is queried: only the identifier is returned (with result['metadata'] = None), and it is not validated.
+    '''
+    if not limits_enabled():
+        return run_pdf2bib(filename, online)
+    result = get_worker().run('pdf2bib', filename, online)
+    retry_queue.connection_failures = retry_queue.connection_failures + result.pop('connection_failures', 0)
+    return result
+
+def extract_titles(filename):
+    '''
+    Returns the candidate titles of the file filename (see the function candidate_titles in title_matcher.py). If a time or memory limit is set,
+    the titles are extracted inside the worker process, and ExtractionFailed is raised if the file exceeds any of the limits.
+    '''
+    if not limits_enabled():
+        return _titles_task(filename)
+    return get_worker().run('titles', filename)
+
+def get_worker():
+    global _worker
+    if _worker is None:
+        if config.get('file_max_mem') and psutil is None and not os.path.exists('/proc/self/statm'):
+            logger.error("The memory used by the worker process cannot be measured on this system (install the library psutil to enable this feature). Only the time limit will be enforced.")
+        _worker = ExtractionWorker()
+    return _worker
+
+@atexit.register
+def shutdown():
+    global _worker
+    if _worker is not None:
+        _worker.stop()
+        _worker = None